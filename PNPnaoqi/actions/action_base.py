@@ -4,9 +4,26 @@ import sys
 import time
 import threading
 import os
+import Queue
+import collections
 
 G_actionThread_exec = {}  # action thread execution functions
-G_actionThreads = {}  # action threads functions
+G_actionThreads = {}  # action threads functions (or queued jobs)
+
+# bounded pool of threads executing the actions
+MAX_ACTION_THREADS = 8
+MAX_QUEUED_ACTIONS = 32  # None for no limit
+MAX_ACTION_CONCURRENCY = 4  # default max running jobs of the same action, None for no limit
+G_actionQueue = Queue.Queue()
+G_workers = []
+G_stats = {'queued': 0, 'running': 0, 'completed': 0, 'rejected': 0}
+G_statsLock = threading.Lock()
+
+# per action limits: jobs of the action given to the workers and jobs
+# waiting for a slot of the action
+G_actionLimits = {}
+G_actionActive = {}
+G_actionPending = {}
 
 cakey = "PNP/CurrentAction"
 
@@ -23,11 +40,11 @@ def action_cb(value):
             params=v[2]
         
         if (actionName in G_actionThread_exec):
-            G_actionThreads[actionName] = threading.Thread(target = G_actionThread_exec[v[1]], args=(params,))
-            G_actionThreads[actionName].mem_serv = G_memory_service
-            G_actionThreads[actionName].session = G_session
-            G_actionThreads[actionName].start()
-            G_memory_service.raiseEvent(cakey,actionName+"_"+params)
+            if (submit_action(actionName, params)):
+                G_memory_service.raiseEvent(cakey,actionName+"_"+params)
+            else:
+                print "ERROR: Action ",actionName," rejected, too many queued actions ",G_stats
+                G_memory_service.raiseEvent("PNP_action_result_"+actionName,"failure")
         else:
             print "ERROR: Action ",v[1]," not found !!!"
     elif (v[0]=='end' or v[0]=='stop' or v[0]=='interrupt'):
@@ -36,8 +53,88 @@ def action_cb(value):
             G_actionThreads[actionName].do_run = False  # execution thread associated to actionName
             G_memory_service.raiseEvent(cakey,"")
             # print "DEBUG: action ",actionName," ended.  Thread ",G_actionThreads[actionName]
-        except:
-            print "ERROR: Action ",v[1]," not started !!!"
+        except (IndexError, KeyError):
+            print "ERROR: Action ",v[1:]," not started !!!"
+
+
+class ActionJob:
+    def __init__(self, actionName, params):
+        self.actionName = actionName
+        self.params = params
+        self.do_run = True  # set to False if the action is stopped while queued
+
+
+def set_action_limit(actionName, max_concurrency):
+    # max number of jobs of the action running together (None for no limit)
+    with G_statsLock:
+        G_actionLimits[actionName] = max_concurrency
+
+
+def _dispatch_job(job):
+    # give the job to the workers (called holding G_statsLock)
+    G_actionQueue.put(job)
+    # start a new worker only if all the others are busy
+    if (len(G_workers)<MAX_ACTION_THREADS and G_stats['running']+G_actionQueue.qsize()>len(G_workers)):
+        w = threading.Thread(target = action_worker)
+        w.daemon = True
+        G_workers.append(w)
+        w.start()
+
+
+def submit_action(actionName, params):
+    job = ActionJob(actionName, params)
+    with G_statsLock:
+        if (MAX_QUEUED_ACTIONS is not None and G_stats['queued']>=MAX_QUEUED_ACTIONS):
+            G_stats['rejected'] += 1
+            return False
+        G_stats['queued'] += 1
+        G_actionThreads[actionName] = job
+        limit = G_actionLimits.get(actionName, MAX_ACTION_CONCURRENCY)
+        if (limit is None or G_actionActive.get(actionName, 0)<limit):
+            G_actionActive[actionName] = G_actionActive.get(actionName, 0) + 1
+            _dispatch_job(job)
+        else:
+            # the action has all its slots busy: wait for one of its jobs to end
+            G_actionPending.setdefault(actionName, collections.deque()).append(job)
+    return True
+
+
+def action_worker():
+    t = threading.currentThread()
+    while True:
+        job = G_actionQueue.get()
+        with G_statsLock:
+            G_stats['queued'] -= 1
+            G_stats['running'] += 1
+        try:
+            if (job.do_run):
+                # the action body reads these attributes from its thread
+                t.do_run = True
+                t.mem_serv = G_memory_service
+                t.session = G_session
+                if (G_actionThreads.get(job.actionName) is job):
+                    G_actionThreads[job.actionName] = t
+                G_actionThread_exec[job.actionName](job.params)
+                # the thread is reused: a later stop of this action must not affect it
+                if (G_actionThreads.get(job.actionName) is t):
+                    G_actionThreads[job.actionName] = job
+        except Exception as e:
+            print "ERROR: Action ",job.actionName," exception ",e
+            G_memory_service.raiseEvent("PNP_action_result_"+job.actionName,"failure")
+        with G_statsLock:
+            G_stats['running'] -= 1
+            G_stats['completed'] += 1
+            # the slot of the action goes to its next pending job
+            pending = G_actionPending.get(job.actionName)
+            if (pending):
+                _dispatch_job(pending.popleft())
+            else:
+                G_actionActive[job.actionName] -= 1
+
+
+def action_stats():
+    with G_statsLock:
+        return dict(G_stats)
 
 
 def initApp(actionName):
@@ -65,9 +162,10 @@ def initApp(actionName):
 	return app
 
 
-def init(session, actionName, actionThread_exec):
+def init(session, actionName, actionThread_exec, max_concurrency=MAX_ACTION_CONCURRENCY):
     global G_actionThread_exec, G_memory_service, G_session, acb
     G_actionThread_exec[actionName] = actionThread_exec # execution thread function associated to actionName
+    set_action_limit(actionName, max_concurrency)
     G_session = session
 
     G_memory_service  = session.service("ALMemory")
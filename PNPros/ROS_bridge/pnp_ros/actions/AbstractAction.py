@@ -1,7 +1,11 @@
 import os
 import sys
 import rospy
+import actionlib
 import threading
+import collections
+import concurrent.futures
+import std_msgs.msg
 
 from abc import ABC, abstractmethod
 from pnp_msgs.msg import PNPActionFeedback, PNPResult
@@ -14,9 +18,205 @@ except:
 
 import pnp_common
 from pnp_common import *
+from pnp_condition_client import get_condition_client
+
+class ActionExecutor(object):
+    ''' Runs the action bodies on a bounded pool of threads.
+
+        At most max_workers actions run together and at most max_concurrency
+        instances of the same action class (class attribute of the action, or
+        set_class_limit); the others wait in a queue. If max_queued is set,
+        goals arriving when the queue is full are rejected. '''
+
+    def __init__(self, max_workers=32, max_queued=None):
+        self.max_workers = max_workers
+        self.max_queued = max_queued
+        self._pool = concurrent.futures.ThreadPoolExecutor(max_workers, thread_name_prefix="pnp_action")
+        self._lock = threading.Lock()
+        self._class_limits = {}
+        self._class_running = collections.defaultdict(int)
+        self._class_pending = collections.defaultdict(collections.deque)
+
+        # counters
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.rejected = 0
+
+    def set_class_limit(self, action_name, max_concurrency):
+        self._class_limits[action_name] = max_concurrency
+
+    def _class_limit(self, action_class):
+        return self._class_limits.get(action_class.__name__, action_class.max_concurrency)
+
+    def submit(self, action):
+        ''' Returns False if the action is rejected '''
+        action_class = action.__class__
+        limit = self._class_limit(action_class)
+        with self._lock:
+            if self.max_queued is not None and self.queued >= self.max_queued:
+                self.rejected += 1
+                return False
+            self.queued += 1
+            if limit is None or self._class_running[action_class] < limit:
+                self._class_running[action_class] += 1
+                self._pool.submit(self._run, action)
+            else:
+                self._class_pending[action_class].append(action)
+        return True
+
+    def _run(self, action):
+        with self._lock:
+            self.queued -= 1
+            self.running += 1
+        try:
+            action._actionThread_exec()
+        except Exception as e:
+            rospy.logerr("Exception in action %s: %s" % (action.__class__.__name__, e))
+        finally:
+            action_class = action.__class__
+            with self._lock:
+                self.running -= 1
+                self.completed += 1
+                # the slot of the class goes to the next goal of the same class
+                if self._class_pending[action_class]:
+                    self._pool.submit(self._run, self._class_pending[action_class].popleft())
+                else:
+                    self._class_running[action_class] -= 1
+
+    def stats(self):
+        with self._lock:
+            return {"queued": self.queued, "running": self.running,
+                    "completed": self.completed, "rejected": self.rejected}
+
+
+class GoalConditionWatcher(object):
+    ''' Wakes up the running actions when one of the conditions their goal
+        depends on is updated (condition update topic of ConditionManager).
+        The watched conditions are activated when the first action waits on
+        them: pinned until the last one is done with the ConditionManager of
+        this process, asked once to the condition services otherwise. '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._events = collections.defaultdict(set)  # condition name -> events
+        self._subscriber = None
+        # True when notify is called directly by the ConditionManager of this process
+        self.local_updates = False
+        # pin/unpin of the ConditionManager of this process
+        self.pin = None
+        self.unpin = None
+
+    def register(self, condition_names, event):
+        with self._lock:
+            if self._subscriber is None and not self.local_updates:
+                self._subscriber = rospy.Subscriber(TOPIC_CONDITIONUPDATE, std_msgs.msg.String,
+                                                    self._condition_update_cb)
+            added = [name for name in condition_names if name not in self._events]
+            for name in condition_names:
+                self._events[name].add(event)
+        self._activate(added)
+
+    def unregister(self, condition_names, event):
+        removed = []
+        with self._lock:
+            for name in condition_names:
+                self._events[name].discard(event)
+                if not self._events[name]:
+                    del self._events[name]
+                    removed.append(name)
+        if self.unpin is not None:
+            for name in removed:
+                self.unpin(name)
+
+    def _activate(self, condition_names):
+        if self.pin is not None:
+            for name in condition_names:
+                self.pin(name)
+            return
+        # the condition is activated by its first request
+        for name in condition_names:
+            try:
+                get_condition_client().get_value(name)
+            except (rospy.ServiceException, rospy.ROSException) as e:
+                rospy.logwarn("Cannot activate goal condition %s: %s" % (name, e))
+
+    def notify(self, condition_name):
+        with self._lock:
+            events = list(self._events.get(condition_name, ()))
+        for event in events:
+            event.set()
+
+    def _condition_update_cb(self, data):
+        # "Name_value"
+        self.notify(data.data.split("_", 1)[0])
+
+
+class ConnectionRegistry(object):
+    ''' Publishers, service proxies and action clients shared by all the actions.
+
+        Each connection is created the first time it is asked, keyed by name
+        and type, and the same instance is returned to the next callers, so
+        starting an action does not pay the connection setup again. '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._connections = {}
+        self._key_locks = collections.defaultdict(threading.Lock)
+
+    def _get(self, key, create):
+        connection = self._connections.get(key)
+        if connection is not None:
+            return connection
+        with self._lock:
+            key_lock = self._key_locks[key]
+        # connections are created outside the registry lock (e.g. waiting for a server)
+        with key_lock:
+            connection = self._connections.get(key)
+            if connection is None:
+                connection = create()
+                self._connections[key] = connection
+        return connection
+
+    def publisher(self, name, data_class, latch=False, queue_size=10):
+        return self._get(("publisher", name, data_class, latch, queue_size),
+                         lambda: rospy.Publisher(name, data_class, latch=latch, queue_size=queue_size))
+
+    def service_proxy(self, name, service_class):
+        return self._get(("service", name, service_class),
+                         lambda: rospy.ServiceProxy(name, service_class))
+
+    def action_client(self, name, action_class):
+        ''' ActionClient connected to the server (waits for it only at creation).
+            It tracks many goals together: each action keeps the goal handle
+            returned by send_goal and cancels or reads the result through it. '''
+        def create():
+            client = actionlib.ActionClient(name, action_class)
+            rospy.loginfo("Connecting to %s AS..." % name)
+            client.wait_for_server()
+            rospy.loginfo("Connected.")
+            return client
+        return self._get(("action", name, action_class), create)
+
 
 class AbstractAction(ABC):
 
+    # max number of goals of this action running together (None: no limit)
+    max_concurrency = None
+
+    # conditions the goal depends on: if set, is_goal_reached is checked
+    # again only when one of them is updated or at goal_deadline()
+    goal_conditions = ()
+
+    # executor of the action bodies, shared by all the actions
+    executor = ActionExecutor()
+
+    # wakes up the actions waiting on goal_conditions
+    goal_watcher = GoalConditionWatcher()
+
+    # connections shared by the actions
+    connections = ConnectionRegistry()
+
     def __init__(self, goalhandler, params):
         self.goalhandler = goalhandler
         self.params = params
@@ -24,6 +224,9 @@ class AbstractAction(ABC):
         # create event for stopping the action
         self.cancel_event = threading.Event()
 
+        # set when the goal has to be checked again
+        self.goal_event = threading.Event()
+
     @abstractmethod
     def _start_action(self):
         raise NotImplementedError()
@@ -40,33 +243,85 @@ class AbstractAction(ABC):
         ''' Static definition of goal reached for the action '''
         raise NotImplementedError()
 
+    @staticmethod
+    def conditions():
+        ''' Client of the conditions (in process when hosted by PNPActionServer) '''
+        return get_condition_client()
+
+    def goal_starting_time(self):
+        ''' ROS time (sec) of the stamp of the current goal (GoalStartingTime), None if unknown '''
+        starting_time = self.conditions().get_value("GoalStartingTime")
+        try:
+            return float(starting_time)
+        except (TypeError, ValueError):
+            return None
+
+    def goal_deadline(self):
+        ''' ROS time (sec) when the goal has to be checked even if none of the
+            goal_conditions has changed, None if there is no deadline '''
+        return None
+
+    def _wait_goal_check(self, r):
+        if not self.goal_conditions:
+            r.sleep()
+            return
+        # woken up by the updates of the goal conditions, anyway at the period
+        # of the loop (feedback, updates lost) and at the deadline
+        timeout = r.sleep_dur.to_sec()
+        deadline = self.goal_deadline()
+        if deadline is not None:
+            remaining = deadline - rospy.get_time()
+            if remaining > 0:
+                timeout = min(timeout, remaining)
+        self.goal_event.wait(timeout)
+
     ## main execution thread
     def _actionThread_exec(self):
         result = PNPResult()
         feedback = PNPActionFeedback()
 
+        # interrupted while waiting in the executor queue: never start it
+        if self.cancel_event.isSet():
+            rospy.loginfo("Action %s interrupted before starting" % self.goalhandler.get_goal().name)
+            publish_action_status(self.goalhandler.get_goal().name, ACTION_INTERRUPT)
+            result.result = 'interrupted'
+            self.goalhandler.set_canceled(result, 'interrupted')
+            return
+
         self._start_action()
 
-        rospy.set_param(get_robot_key(PARAM_PNPACTIONSTATUS) + self.goalhandler.get_goal().name, ACTION_RUNNING)
+        publish_action_status(self.goalhandler.get_goal().name, ACTION_RUNNING)
 
         # rate 0.5hz
         r = rospy.Rate(2)
 
-        # wait until the action is done
-        while not self._is_action_done():
-            # request to cancel action
-            if self.cancel_event.isSet():
-                break
+        if self.goal_conditions:
+            AbstractAction.goal_watcher.register(self.goal_conditions, self.goal_event)
 
-            # send feedback
-            feedback.feedback = 'running'
-            self.goalhandler.publish_feedback(feedback)
+        try:
+            # wait until the action is done
+            while True:
+                # updates arriving from now on wake up the next wait
+                self.goal_event.clear()
+                if self._is_action_done():
+                    break
 
-            r.sleep()
+                # request to cancel action
+                if self.cancel_event.isSet():
+                    break
+
+                # send feedback
+                feedback.feedback = 'running'
+                self.goalhandler.publish_feedback(feedback)
+
+                self._wait_goal_check(r)
+        finally:
+            if self.goal_conditions:
+                AbstractAction.goal_watcher.unregister(self.goal_conditions, self.goal_event)
 
         self._stop_action()
 
-        rospy.set_param(get_robot_key(PARAM_PNPACTIONSTATUS) + self.goalhandler.get_goal().name, ACTION_SUCCESS)
+        publish_action_status(self.goalhandler.get_goal().name, ACTION_SUCCESS)
 
         # send the result
         result.result = 'OK'
@@ -74,8 +329,14 @@ class AbstractAction(ABC):
 
 
     def start_action(self):
-        th = threading.Thread(None, self._actionThread_exec, args=())
-        th.start()
+        if not AbstractAction.executor.submit(self):
+            rospy.logwarn("Action %s rejected, too many queued goals %s"
+                          % (self.goalhandler.get_goal().name, AbstractAction.executor.stats()))
+            publish_action_status(self.goalhandler.get_goal().name, ACTION_FAILURE)
+            result = PNPResult()
+            result.result = 'rejected'
+            self.goalhandler.set_aborted(result, 'rejected')
 
     def interrupt_action(self):
         self.cancel_event.set()
+        self.goal_event.set()
@@ -2,7 +2,6 @@ import os
 import sys
 import rospy
 import inspect
-import fnmatch
 from importlib import util
 from AbstractAction import AbstractAction
 from pnp_msgs.msg import PNPResult, PNPGoal
@@ -16,54 +15,86 @@ except:
 import pnp_common
 from pnp_common import *
 
+from pnp_plugins import discover_plugins, get_manifest_path, LazyPlugin, PluginReloader
+
 class ActionManager():
 
+    # process-wide registry action name -> LazyPlugin of the action class,
+    # built once at startup (action modules are imported at the first use)
+    _action_registry = {}
+
     def __init__(self, actions_folder=None):
         self._action_instances = {}
-        self._implemented_actions = []
-
-        actions_found = self._search_actions(actions_folder)
+        self._actions_folder = actions_folder
 
-        for action_class in actions_found:
-            self._implemented_actions.append(action_class)
+        ActionManager.build_registry(actions_folder)
 
         # Start interrupted_goal topic
         self._interrupted_goal_publisher = rospy.Publisher('interrupted_goal', PNPGoal, queue_size=10, latch=True)
 
+        # Start the action status topic before the first goal arrives
+        init_action_status_publisher()
+
     @staticmethod
     def _search_actions(actions_folder):
-        actions_found = []
-        # Find all the actions implemented
+        # Find all the actions implemented (static scan, nothing is imported here)
         directory = os.path.dirname(os.path.abspath(__file__))
-        potential_files = [os.path.join(dirpath, f)
-                    for dirpath, _, files in os.walk(directory, followlinks=True)
-                    for f in fnmatch.filter(files, '*.py')]
-        if actions_folder is not None:
-            potential_files += [os.path.join(dirpath, f)
-                    for dirpath, _, files in os.walk(actions_folder, followlinks=True)
-                    for f in fnmatch.filter(files, '*.py')]
-        for file in potential_files:
-            module_name = os.path.splitext(os.path.basename(file))[0]
-            package_name = os.path.dirname(os.path.relpath(file, directory)).replace("/", ".")
-            action_class = ActionManager._find_action_implementation(file, module_name)
-            if action_class:
-                actions_found.append(action_class)
-                rospy.loginfo("Found implemented action " + module_name)
+        actions_found = discover_plugins([directory, actions_folder], AbstractAction.__name__,
+                                         get_manifest_path("actions"))
+        for module_name in actions_found.keys():
+            rospy.loginfo("Found implemented action " + module_name)
 
         return actions_found
 
+    @staticmethod
+    def build_registry(actions_folder=None):
+        registry = {}
+        for (action_name, file) in ActionManager._search_actions(actions_folder).items():
+            registry[action_name] = LazyPlugin(action_name, file, ActionManager._find_action_implementation)
+        # replace the whole dict, readers never see a partial registry
+        ActionManager._action_registry = registry
+
+    def reload_actions(self, changed_files):
+        ''' Re-import the actions defined in the changed files and swap them in the registry.
+            New goals use the new classes, running instances keep the old code. '''
+        actions_found = ActionManager._search_actions(self._actions_folder)
+        registry = dict(ActionManager._action_registry)
+        for action_name in list(registry.keys()):
+            if action_name not in actions_found:
+                del registry[action_name]
+                rospy.loginfo("Removed action " + action_name)
+        for (action_name, file) in actions_found.items():
+            if action_name in registry and registry[action_name].path == file and file not in changed_files:
+                continue
+            plugin = LazyPlugin(action_name, file, ActionManager._find_action_implementation)
+            if plugin.get() is None and action_name in registry:
+                rospy.logwarn("Cannot reload action " + action_name + ", keeping the previous version")
+                continue
+            registry[action_name] = plugin
+            rospy.loginfo("Reloaded action " + action_name)
+        ActionManager._action_registry = registry
+
+    def start_reloader(self, period=2.0):
+        directory = os.path.dirname(os.path.abspath(__file__))
+        reloader = PluginReloader([directory, self._actions_folder], self.reload_actions, period)
+        reloader.start()
+        return reloader
+
+    @staticmethod
+    def get_action_class(action_name):
+        plugin = ActionManager._action_registry.get(action_name)
+        if plugin is None:
+            return None
+        return plugin.get()
+
     def get_actions(self):
-        return [action.__name__ for action in self._implemented_actions]
+        return list(ActionManager._action_registry.keys())
 
     def start_action(self, goalhandler):
         goal = goalhandler.get_goal()
 
         # search for an implementation of the action
-        action = None
-        for action_impl in self._implemented_actions:
-            if action_impl.__name__ == goal.name:
-                action = action_impl
-                break
+        action = ActionManager.get_action_class(goal.name)
 
         if action is not None:
             # accept the goal
@@ -91,13 +122,13 @@ class ActionManager():
             else:
                 print("[AM] Stopping " + goal.name + " " + goal.params + " " + str(goal.id))
                 # send the result
-                rospy.set_param(get_robot_key(PARAM_PNPACTIONSTATUS) + goalhandler.get_goal().name, ACTION_SUCCESS)
+                publish_action_status(goalhandler.get_goal().name, ACTION_SUCCESS)
 
                 result = PNPResult()
                 result.result = 'OK'
                 goalhandler.set_succeeded(result, 'OK')
         else:
-            rospy.set_param(get_robot_key(PARAM_PNPACTIONSTATUS) + goalhandler.get_goal().name, ACTION_NOT_IMPLEMENTED)
+            publish_action_status(goalhandler.get_goal().name, ACTION_NOT_IMPLEMENTED)
             rospy.logwarn("action " + goal.name + " not implemented")
 
     def interrupt_action(self, goalhandler):
@@ -136,12 +167,7 @@ class ActionManager():
     @staticmethod
     def is_goal_reached(action_name, parameters):
         # search for an implementation of the action
-        action = None
-        actions_found = ActionManager._search_actions()
-        for action_found in actions_found:
-            if action_found.__name__ == action_name:
-                action = action_found
-                break
+        action = ActionManager.get_action_class(action_name)
 
         if action is not None:
             # Instantiate the action
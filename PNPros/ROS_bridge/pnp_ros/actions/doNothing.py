@@ -1,34 +1,47 @@
 import rospy
 from AbstractAction import AbstractAction
-from pnp_msgs.srv import PNPCondition, PNPConditionValue
 
 class doNothing(AbstractAction):
 
+    goal_conditions = ("CurrentGoal", "GoalStartingTime")
+
     def _start_action(self):
         rospy.loginfo('Doing nothing for ' + " ".join(self.params) + ' seconds ...')
-        #self.starting_time = rospy.Time.now()
+        self.starting_time = rospy.get_time()
+
+    def goal_deadline(self):
+        # the goal is checked again when its time is elapsed from the goal stamp
+        starting_time = self.goal_starting_time()
+        if starting_time is None:
+            starting_time = self.starting_time
+        return starting_time + self.duration(self.params) + 0.01
 
     def _stop_action(self):
         rospy.loginfo('Finished doing nothing')
 
-    @classmethod
-    def is_goal_reached(cls, params):
-        ''' check conditions CurrentGoal and GoalStartingTime '''
-        condition_value_sp = rospy.ServiceProxy("/PNPConditionValue", PNPConditionValue)
-        condition_eval_sp = rospy.ServiceProxy("/PNPConditionEval", PNPCondition)
-
+    @staticmethod
+    def duration(params):
+        ''' Seconds to do nothing (5 if not given or not an integer) '''
         time = 5 #seconds
         if len(params) > 0:
             try:
                 time = int(params[0])
             except ValueError:
-                return False
+                rospy.logwarn_once("doNothing: wrong time '%s', using %d seconds" % (params[0], time))
+        return time
+
+    @classmethod
+    def is_goal_reached(cls, params):
+        ''' check conditions CurrentGoal and GoalStartingTime '''
+        conditions = cls.conditions()
+
+        time = cls.duration(params)
 
         # The goal is reached when we have finished saying what we actually want to say
         current_goal_cond = "CurrentGoal_" + cls.__name__ + "_" + "_".join(params)
-        if condition_eval_sp(current_goal_cond).truth_value:
+        if conditions.evaluate(current_goal_cond):
             # check that the elapsed time is enough
-            starting_time = condition_value_sp("GoalStartingTime").value
+            starting_time = conditions.get_value("GoalStartingTime")
             if starting_time != "None":
                 elapsed_time = rospy.Time.now() - rospy.Time.from_sec(float(starting_time))
                 if elapsed_time.to_sec() > time:
@@ -1,42 +1,36 @@
 import rospy
-import actionlib
 
 from topological_navigation.msg import GotoNodeActionGoal, GotoNodeAction
-from actionlib_msgs.msg import GoalID
 from AbstractAction import AbstractAction
-from pnp_msgs.srv import PNPCondition
 from geometry_msgs.msg import Twist
 
 
 class goto(AbstractAction):
 
+    goal_conditions = ("CurrentNode",)
+
     def _start_action(self):
         goal_topo = str(self.params[0])
 
         self.nav_goal = GotoNodeActionGoal()
         self.nav_goal.goal.target = goal_topo
 
-        self.nav_ac = actionlib.SimpleActionClient("/topological_navigation", GotoNodeAction)
-        rospy.loginfo("Connecting to /topological_navigation AS...")
-        self.nav_ac.wait_for_server()
-        rospy.loginfo("Connected.")
+        self.nav_ac = self.connections.action_client("/topological_navigation", GotoNodeAction)
 
-        # send navigation goal
-        self.nav_ac.send_goal(self.nav_goal.goal)
+        # send navigation goal (the client is shared, the handle is of this goal)
+        self.nav_gh = self.nav_ac.send_goal(self.nav_goal.goal)
         rospy.loginfo("Waiting for result...")
 
         # cmdvel Publisher
-        self._cmdVelPub = rospy.Publisher("cmd_vel", Twist, latch=True, queue_size=10)
+        self._cmdVelPub = self.connections.publisher("cmd_vel", Twist, latch=True)
 
         print("START ACTION GOTO")
 
 
     def _stop_action(self):
 
-        cancel_goal = GoalID()
-        cancel_goal.id = self.nav_goal.goal_id.id
-        pub = rospy.Publisher('/topological_navigation/cancel', GoalID, queue_size=10)
-        pub.publish(cancel_goal)
+        # cancel only the goal of this action
+        self.nav_gh.cancel()
 
         # let's be sure that the robot stops
         #cancel_goal.id = ""
@@ -54,10 +48,8 @@ class goto(AbstractAction):
         '''Check condition CurrentNode'''
         goal_node = str(params[0])
 
-        service_proxy = rospy.ServiceProxy("/PNPConditionEval", PNPCondition)
-
         condition = "CurrentNode_" + goal_node
-        reached = service_proxy(condition).truth_value
+        reached = cls.conditions().evaluate(condition)
         return reached
 
         #if self.nav_ac.get_result():
@@ -2,7 +2,7 @@ import rospy
 
 from AbstractAction import AbstractAction
 from ActionManager import ActionManager
-from pnp_msgs.srv import PNPStartStateActionSaver, PNPStopStateActionSaver, PNPConditionValue
+from pnp_msgs.srv import PNPStartStateActionSaver, PNPStopStateActionSaver
 
 class recordDemonstration(AbstractAction):
 
@@ -16,11 +16,9 @@ class recordDemonstration(AbstractAction):
             print "Recording ", goal_str, "(requested)..."
         else:
             # Get the action for which we want a demonstration taking the last interrupted goal
-            service_proxy = rospy.ServiceProxy("/PNPConditionValue", PNPConditionValue)
-
             condition = "InterruptedGoal"
             # get the last interrupted goal
-            interrupted_goal = service_proxy(condition).value.split("_")
+            interrupted_goal = self.conditions().get_value(condition).split("_")
 
             goal_action = interrupted_goal[0]
             goal_params = interrupted_goal[1:]
@@ -29,7 +27,7 @@ class recordDemonstration(AbstractAction):
             print "Recording ", goal_str, "(interrupted)..."
 
         # call the starting service
-        starting_sp = rospy.ServiceProxy("start_state_action_saver", PNPStartStateActionSaver)
+        starting_sp = self.connections.service_proxy("start_state_action_saver", PNPStartStateActionSaver)
         self._goal_str = goal_str
 
         response = starting_sp(self._goal_str, "", [], [], True).succeeded
@@ -40,7 +38,7 @@ class recordDemonstration(AbstractAction):
     def _stop_action(self):
         # call the stopping service
         if self._goal_str:
-            stopping_sp = rospy.ServiceProxy("stop_state_action_saver", PNPStopStateActionSaver)
+            stopping_sp = self.connections.service_proxy("stop_state_action_saver", PNPStopStateActionSaver)
             response = stopping_sp(self._goal_str).succeeded
 
     @classmethod
@@ -51,19 +49,17 @@ class recordDemonstration(AbstractAction):
             goal_params = params[1:]
         else:
             # Get the action for which we want a demonstration taking the last interrupted goal
-            service_proxy = rospy.ServiceProxy("/PNPConditionValue", PNPConditionValue)
-
             condition = "InterruptedGoal"
 
             # get the last interrupted goal
-            interrupted_goal = service_proxy(condition).value.split("_")
+            interrupted_goal = cls.conditions().get_value(condition).split("_")
 
             goal_action = interrupted_goal[0]
             goal_params = interrupted_goal[1:]
 
         if goal_action:
             # check that there is a saver running for this goal
-            check_sp = rospy.ServiceProxy("running_state_action_saver", PNPStopStateActionSaver)
+            check_sp = cls.connections.service_proxy("running_state_action_saver", PNPStopStateActionSaver)
             running = check_sp(goal_action + "_".join([""] + goal_params))
 
             if running.succeeded:
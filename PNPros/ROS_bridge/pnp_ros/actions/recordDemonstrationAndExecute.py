@@ -1,6 +1,5 @@
 import rospy
 
-import actionlib
 from ActionManager import ActionManager
 from AbstractAction import AbstractAction
 from pnp_msgs.msg import PNPAction, PNPActionGoal
@@ -12,10 +11,7 @@ class recordDemonstrationAndExecute(AbstractAction):
         goal_params = self.params[1:]
 
         # COnnecting to the action server
-        pub = actionlib.SimpleActionClient("/PNP", PNPAction)
-        rospy.loginfo("Connecting to /PNP/goal AS...")
-        pub.wait_for_server()
-        rospy.loginfo("Connected.")
+        pub = self.connections.action_client("/PNP", PNPAction)
 
         # recording goal
         pnp_record_goal = PNPActionGoal()
@@ -40,10 +36,7 @@ class recordDemonstrationAndExecute(AbstractAction):
         goal_params = self.params[1:]
 
         # COnnecting to the action server
-        pub = actionlib.SimpleActionClient("/PNP", PNPAction)
-        rospy.loginfo("Connecting to /PNP/goal AS...")
-        pub.wait_for_server()
-        rospy.loginfo("Connected.")
+        pub = self.connections.action_client("/PNP", PNPAction)
 
         # recording goal
         pnp_record_goal = PNPActionGoal()
@@ -17,7 +17,7 @@ class recordRecoveryDemonstration(AbstractAction):
         #cancel_goal.id = ""
         #pub = rospy.Publisher('/move_base/cancel', GoalID, queue_size=10)
         #pub.publish(cancel_goal)
-        pub = rospy.Publisher("cmd_vel", Twist, latch=True, queue_size=10)
+        pub = self.connections.publisher("cmd_vel", Twist, latch=True)
         twist = Twist()
         twist.linear.x = 0.
         twist.angular.z = 0.
@@ -25,7 +25,7 @@ class recordRecoveryDemonstration(AbstractAction):
 
         ## Register the recovery trajectory
         # start recording scan and twist
-        starting_sp = rospy.ServiceProxy("start_state_action_saver", PNPStartStateActionSaver)
+        starting_sp = self.connections.service_proxy("start_state_action_saver", PNPStartStateActionSaver)
         self.goal_id = rospy.Time.now().to_nsec()
         folder = '%s/catkin_ws/data/recover_trajectories'  % os.path.expanduser("~")
         filepath = '%s/%s.txt' % (folder, self.goal_id)
@@ -65,10 +65,10 @@ class recordRecoveryDemonstration(AbstractAction):
 
     def _stop_action(self):
         if "goal_id" in dir(self):
-            stopping_sp = rospy.ServiceProxy("stop_state_action_saver", PNPStopStateActionSaver)
+            stopping_sp = self.connections.service_proxy("stop_state_action_saver", PNPStopStateActionSaver)
             response = stopping_sp(str(self.goal_id)).succeeded
             # new demostration signal Publisher
-            signal_pub = rospy.Publisher("new_recovery_demonstration", String, latch=True, queue_size=10)
+            signal_pub = self.connections.publisher("new_recovery_demonstration", String, latch=True)
             msg = String("")
             signal_pub.publish(msg)
 
@@ -16,16 +16,16 @@ class recoverAction(AbstractAction):
         # stop the robot
         cancel_goal = GoalID()
         cancel_goal.id = ""
-        pub = rospy.Publisher('/move_base/cancel', GoalID, queue_size=10)
+        pub = self.connections.publisher('/move_base/cancel', GoalID)
         pub.publish(cancel_goal)
-        pub = rospy.Publisher("cmd_vel", Twist, latch=True, queue_size=10)
+        pub = self.connections.publisher("cmd_vel", Twist, latch=True)
         twist = Twist()
         twist.linear.x = 0.
         twist.angular.z = 0.
         pub.publish(twist)
 
         # Ask for confirmation by human
-        conf_pub = rospy.Publisher("failure_signal_confirmation", ActionFailure, latch=True, queue_size=10)
+        conf_pub = self.connections.publisher("failure_signal_confirmation", ActionFailure, latch=True)
 
         window = tk.Tk()
         self.confirmed = None
@@ -63,7 +63,7 @@ class recoverAction(AbstractAction):
             msg.cause = "positive"
             conf_pub.publish(msg)
             # start recovery service
-            start_sp = rospy.ServiceProxy("start_recovery_execution", Empty)
+            start_sp = self.connections.service_proxy("start_recovery_execution", Empty)
             start_sp()
             self.params[len(self.params):] = [rospy.Time.now().to_sec()]
             self.params[len(self.params):] = ["recovering"]
@@ -93,7 +93,7 @@ class recoverAction(AbstractAction):
 
     def _stop_action(self):
         if self.params[-1] == "recovering":
-            stop_sp = rospy.ServiceProxy("stop_recovery_execution", Empty)
+            stop_sp = self.connections.service_proxy("stop_recovery_execution", Empty)
             stop_sp()
 
     @classmethod
@@ -69,7 +69,7 @@ class saveTrajectory(AbstractAction):
         np.save('%s/detector_model_Y.npy' % folder, Y)
 
         # Signal the model update event
-        sign_pub = rospy.Publisher("failure_model_updated", String, latch=True, queue_size=10)
+        sign_pub = self.connections.publisher("failure_model_updated", String, latch=True)
         sign_pub.publish(String(""))
 
         # Signal that the action is done
@@ -1,10 +1,64 @@
+import os
+import sys
+import time
 import rospy
+import threading
 from abc import ABC, abstractmethod
 
+try:
+    sys.path.append(os.environ["PNP_HOME"] + '/scripts')
+except:
+    print("Please set PNP_HOME environment variable to PetriNetPlans folder.")
+    sys.exit(1)
+
+from pnp_condition_client import get_condition_client
+from ConditionHistory import ConditionHistory
+
 class AbstractCondition(ABC):
 
+    # memoize the results of evaluate(params): they are valid until the
+    # condition changes (memo_ttl None) or for memo_ttl seconds (0 disables)
+    memoize = False
+    memo_ttl = None
+    memo_maxsize = 1024
+
+    # policy of the updates sent to the listeners: max updates per second
+    # and min change of the typed value (None: no limit)
+    update_max_rate = None
+    update_min_delta = None
+
+    # max time the first use waits for the initial data of the condition
+    init_timeout = 0.5
+
+    # seconds without use after which ConditionManager deactivates the
+    # condition (None: kept active once used)
+    idle_timeout = None
+
+    # number of timestamped changes kept in the history (0: no history)
+    history_size = 0
+
+    # the condition calls receive_update of its listeners at every change of
+    # its result (required by the held_/rose_ operators)
+    notifies_changes = False
+
     def __init__(self):
         self._updates_listeners = []
+        # protects the condition state, shared by all the conditions of a ConditionManager
+        self._state_lock = threading.RLock()
+        # bumped when the condition changes
+        self._version = 0
+        self._memo = {}
+        # set when the initial data is available (the subclasses that fetch it clear it)
+        self._ready = threading.Event()
+        self._ready.set()
+        self._ready_deadline = time.time() + self.init_timeout
+        # called with the condition when it changes (set by ConditionManager)
+        self._on_change = None
+        # time of the last change (None until the first one)
+        self.last_change_time = None
+        self.history = None
+        if self.history_size > 0:
+            self.enable_history(self.history_size)
 
     @abstractmethod
     def evaluate(self, params):
@@ -14,6 +68,75 @@ class AbstractCondition(ABC):
     def get_value(self):
         raise NotImplementedError()
 
+    def enable_history(self, size):
+        ''' Keep the last size changes of the condition (0 disables the history) '''
+        with self._state_lock:
+            self.history = ConditionHistory(size) if size > 0 else None
+
+    def get_typed_value(self):
+        return self.get_value()
+
+    def _render_value(self, value):
+        return str(value)
+
+    def wait_ready(self):
+        ''' Wait for the initial data, at most until init_timeout after the creation '''
+        if not self._ready.is_set():
+            remaining = self._ready_deadline - time.time()
+            if remaining > 0:
+                self._ready.wait(remaining)
+        return self._ready.is_set()
+
+    def evaluate_memoized(self, params):
+        if not self.memoize or self.memo_ttl == 0:
+            return self.evaluate(params)
+        key = tuple(params)
+        now = time.time() if self.memo_ttl else 0
+        entry = self._memo.get(key)
+        if entry is not None and (not self.memo_ttl or now - entry[0] < self.memo_ttl):
+            return entry[1]
+        version = self._version
+        res = self.evaluate(params)
+        with self._state_lock:
+            # do not store a result computed while the condition was changing
+            if version == self._version:
+                if len(self._memo) >= self.memo_maxsize:
+                    self._memo = {}
+                self._memo[key] = (now, res)
+        return res
+
+    def _snapshot_state(self):
+        ''' State of the condition stored in the ConditionSnapshot (call it holding _state_lock) '''
+        return None
+
+    def evaluate_snapshot(self, snapshot, params):
+        ''' Evaluate the condition on its state in the snapshot. By default the
+            condition is evaluated on its current state (e.g. service conditions). '''
+        return self.evaluate_memoized(params)
+
+    def _change_time(self):
+        ''' Time of the change being applied (the subclasses may use the message stamp) '''
+        return rospy.get_time()
+
+    def _changed(self):
+        ''' Invalidate the memoized results (call it holding _state_lock) '''
+        self._version += 1
+        self._memo = {}
+        self.last_change_time = self._change_time()
+        if self.history is not None:
+            self.history.append(self.last_change_time, self.get_typed_value())
+        if self._on_change is not None:
+            self._on_change(self)
+
+    @staticmethod
+    def conditions():
+        ''' Client of the other conditions (in process when hosted by PNPActionServer) '''
+        return get_condition_client()
+
+    def shutdown(self):
+        ''' Release the resources of the condition (e.g. when it is reloaded) '''
+        pass
+
 
 class ConditionListener(ABC):
 
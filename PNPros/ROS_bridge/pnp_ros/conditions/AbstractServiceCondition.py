@@ -1,19 +1,32 @@
 import rospy
+import threading
 from abc import ABCMeta, abstractproperty
 from AbstractCondition import AbstractCondition, ConditionListener
 
 class AbstractServiceCondition(AbstractCondition):
 
+    # the results are reused for memo_ttl seconds (set by PNPActionServer)
+    memoize = True
+    memo_ttl = 0.0
+
     def __init__(self):
         super().__init__()
         # create service proxy
+        self.service_proxy = rospy.ServiceProxy(self._service_name, self._service_type)
+
+        # wait for the service in background
+        self._ready.clear()
+        thread = threading.Thread(target=self._wait_service, name="pnp_wait_" + self._service_name)
+        thread.daemon = True
+        thread.start()
+
+    def _wait_service(self):
         try:
-            rospy.wait_for_service(self._service_name, timeout=0.5)
+            rospy.wait_for_service(self._service_name, timeout=self.init_timeout)
+            self._ready.set()
         except rospy.ROSException as e:
             rospy.logwarn("Timeout waiting for service %s" % self._service_name)
 
-        self.service_proxy = rospy.ServiceProxy(self._service_name, self._service_type)
-
     # TODO: is this useful for service conditions?
     def get_value(self):
         return None
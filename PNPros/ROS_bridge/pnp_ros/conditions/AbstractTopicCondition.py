@@ -1,42 +1,155 @@
 import rospy
+import numpy as np
 from abc import ABCMeta, abstractproperty, abstractmethod
 from AbstractCondition import AbstractCondition, ConditionListener
 
 class AbstractTopicCondition(AbstractCondition):
 
+    # the results are valid until the next change of the value
+    memoize = True
+
+    # _get_value_from_data may return typed values (numpy arrays, tuples of
+    # numbers): a new value is a change only if some element differs more
+    # than change_threshold, and quantization rounds the elements to
+    # multiples of the step. They are rendered as strings only by get_value.
+    change_threshold = None
+    quantization = None
+
+    history_size = 256
+
+    notifies_changes = True
+
     def __init__(self):
         super().__init__()
         self.last_value = None
         self.last_data = None
-        
-        # subscribe to the topic with a callback
-        rospy.Subscriber(self._topic_name, self._topic_type, self._callback)
+        self._rendered = None  # (version, string of the typed value)
 
-        # check if it is a latch message, hence we could already have some message
-        try:
-            msg = rospy.wait_for_message(self._topic_name, self._topic_type, timeout=0.5)
-            self.last_data = msg
-            self.last_value = self._get_value_from_data(msg)
-        except rospy.ROSException: # timeout exceeded (no message waiting)
-            # last_data will be None until the subscribed topic will return some data
-            pass
+        # ready at the first message: if the topic is latched it arrives when
+        # the subscriber connects, without blocking the construction here
+        self._ready.clear()
+
+        # subscribe to the topic with a callback
+        self._subscriber = rospy.Subscriber(self._topic_name, self._topic_type, self._callback)
 
     def _callback(self, data):
-        self.last_data = data
-        curr_value = self._get_value_from_data(data)
+        curr_value = self._quantize(self._get_value_from_data(data))
 
-        if self.last_value != curr_value:
-            self.last_value = curr_value
+        with self._state_lock:
+            self.last_data = data
+            changed = self._value_changed(self.last_value, curr_value)
+            if changed:
+                self.last_value = curr_value
+                self._changed()
+            elif not self.memoize:
+                # the result depends on the message itself (e.g. its stamp):
+                # the snapshot gets every message
+                self._data_changed()
+        self._ready.set()
 
+        if changed:
             # update all the listeners
             for listener in self._updates_listeners:
                 listener.receive_update(self)
 
 
+    def evaluate(self, params):
+        return self.evaluate_value(self.last_value, self.last_data, params)
+
+    def evaluate_value(self, value, data, params):
+        ''' Evaluate the condition on the value and the message it comes from '''
+        raise NotImplementedError()
+
+    def _data_changed(self):
+        ''' New message with the same value (call it holding _state_lock) '''
+        self._version += 1
+        self._memo = {}
+        if self._on_change is not None:
+            self._on_change(self)
+
+    def _snapshot_state(self):
+        return (self._version, self.last_value, self.last_data)
+
+    def evaluate_snapshot(self, snapshot, params):
+        name = self.get_name()
+        if type(self).evaluate_value is AbstractTopicCondition.evaluate_value or name not in snapshot:
+            # the subclass evaluates only the current state
+            return self.evaluate_memoized(params)
+        (version, value, data) = snapshot.get_state(name)
+        # the memoized results are valid if the snapshot has the current state
+        memo = None
+        if self.memoize and self.memo_ttl is None and version == self._version:
+            memo = self._memo
+        key = tuple(params)
+        if memo is not None and key in memo:
+            return memo[key][1]
+        res = self.evaluate_value(value, data, params)
+        if memo is not None:
+            with self._state_lock:
+                if version == self._version:
+                    if len(self._memo) >= self.memo_maxsize:
+                        self._memo = {}
+                    self._memo[key] = (0, res)
+        return res
+
+    def _quantize(self, value):
+        step = self.quantization
+        if step is None:
+            return value
+        if isinstance(value, np.ndarray):
+            return np.round(value / step) * step
+        if isinstance(value, tuple):
+            return tuple(round(v / step) * step for v in value)
+        return value
+
+    def _value_changed(self, old_value, new_value, threshold=None):
+        if threshold is None:
+            threshold = self.change_threshold
+        if old_value is None or new_value is None:
+            return old_value is not new_value
+        if isinstance(new_value, (np.ndarray, tuple)):
+            try:
+                a = np.asarray(old_value, dtype=float)
+                b = np.asarray(new_value, dtype=float)
+            except (TypeError, ValueError):
+                return old_value != new_value
+            if a.shape != b.shape:
+                return True
+            return not np.allclose(a, b, rtol=0, atol=threshold or 0, equal_nan=True)
+        return old_value != new_value
+
+    def _change_time(self):
+        # stamp of the message that changed the value, if it has one
+        stamp = getattr(getattr(self.last_data, "header", None), "stamp", None)
+        if stamp is not None and not stamp.is_zero():
+            return stamp.to_sec()
+        return rospy.get_time()
+
+    def _render_value(self, value):
+        if isinstance(value, np.ndarray):
+            value = tuple(value.tolist())
+        return str(value)
 
     def get_value(self):
+        value = self.last_value
+        if value is None or isinstance(value, str):
+            return value
+        # typed value: render it once per change
+        with self._state_lock:
+            value = self.last_value
+            version = self._version
+            rendered = self._rendered
+        if rendered is None or rendered[0] != version:
+            rendered = (version, self._render_value(value))
+            self._rendered = rendered
+        return rendered[1]
+
+    def get_typed_value(self):
         return self.last_value
 
+    def shutdown(self):
+        self._subscriber.unregister()
+
     def get_data(self):
         return self.last_data
 
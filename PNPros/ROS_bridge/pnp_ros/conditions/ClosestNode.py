@@ -10,7 +10,7 @@ class ClosestNode(AbstractTopicCondition):
     def _get_value_from_data(self, data):
         return data.data
 
-    def evaluate(self, params):
+    def evaluate_value(self, value, data, params):
         node = str(params[0])
 
-        return node == self.last_value
+        return node == value
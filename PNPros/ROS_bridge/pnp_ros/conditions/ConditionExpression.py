@@ -0,0 +1,114 @@
+import re
+import threading
+from collections import OrderedDict
+
+_TOKEN_RE = re.compile(r"\(|\)|[^\s()]+")
+_OPERATORS = ("and", "or", "not")
+
+
+def parse_condition_literal(literal):
+    # name_param1_param2 -> (name, [param1, param2])
+    cond_elems = literal.split("_")
+    return cond_elems[0], cond_elems[1:]
+
+
+def is_expression(cond):
+    ''' True if cond is a boolean expression and not a single condition literal '''
+    return " " in cond.strip() or "(" in cond
+
+
+class CompiledExpression():
+    ''' Boolean expression of condition literals (and, or, not, parenthesis)
+        compiled in a tree of closures. and/or are evaluated with short-circuit.
+        The snapshot passed to the call is given to each literal evaluation. '''
+
+    def __init__(self, expression, evaluate_literal):
+        self.expression = expression
+        self._evaluate_literal = evaluate_literal
+        self._tokens = _TOKEN_RE.findall(expression)
+        self._pos = 0
+        self.literals = []
+        self.evaluate = self._parse_or()
+        if self._pos != len(self._tokens):
+            raise ValueError("Unexpected token '%s' in condition expression '%s'"
+                             % (self._tokens[self._pos], expression))
+        del self._tokens
+
+    def __call__(self, snapshot=None):
+        return self.evaluate(snapshot)
+
+    def _peek(self):
+        if self._pos < len(self._tokens):
+            return self._tokens[self._pos]
+        return None
+
+    def _next(self):
+        token = self._peek()
+        if token is None:
+            raise ValueError("Unexpected end of condition expression '%s'" % self.expression)
+        self._pos += 1
+        return token
+
+    def _parse_or(self):
+        terms = [self._parse_and()]
+        while self._peek() == "or":
+            self._next()
+            terms.append(self._parse_and())
+        if len(terms) == 1:
+            return terms[0]
+        return lambda snapshot: any(term(snapshot) for term in terms)
+
+    def _parse_and(self):
+        terms = [self._parse_not()]
+        while self._peek() == "and":
+            self._next()
+            terms.append(self._parse_not())
+        if len(terms) == 1:
+            return terms[0]
+        return lambda snapshot: all(term(snapshot) for term in terms)
+
+    def _parse_not(self):
+        if self._peek() == "not":
+            self._next()
+            term = self._parse_not()
+            return lambda snapshot: not term(snapshot)
+        return self._parse_atom()
+
+    def _parse_atom(self):
+        token = self._next()
+        if token == "(":
+            term = self._parse_or()
+            if self._next() != ")":
+                raise ValueError("Missing ')' in condition expression '%s'" % self.expression)
+            return term
+        if token == ")" or token in _OPERATORS:
+            raise ValueError("Unexpected token '%s' in condition expression '%s'"
+                             % (token, self.expression))
+        # the literal is parsed here once
+        name, params = parse_condition_literal(token)
+        self.literals.append(token)
+        evaluate_literal = self._evaluate_literal
+        return lambda snapshot: evaluate_literal(name, params, snapshot)
+
+
+class ExpressionCache():
+    ''' LRU cache of compiled expressions keyed by the expression string '''
+
+    def __init__(self, evaluate_literal, maxsize=256):
+        self._evaluate_literal = evaluate_literal
+        self.maxsize = maxsize
+        self._expressions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, expression):
+        with self._lock:
+            compiled = self._expressions.get(expression)
+            if compiled is not None:
+                self._expressions.move_to_end(expression)
+                return compiled
+        compiled = CompiledExpression(expression, self._evaluate_literal)
+        with self._lock:
+            self._expressions[expression] = compiled
+            if len(self._expressions) > self.maxsize:
+                self._expressions.popitem(last=False)
+        return compiled
@@ -0,0 +1,121 @@
+import numpy as np
+
+
+class ConditionHistory(object):
+    ''' Bounded ring buffer of the timestamped values of a condition.
+
+        The times are in a preallocated array, kept sorted (a time older than
+        the last one is clamped to it), so value_at and changes_between are
+        binary searches. Numeric values (numbers, numeric tuples and arrays of
+        the same shape) are stored in a preallocated array and returned as
+        numpy values, the others in a list. '''
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._times = np.empty(capacity, dtype=float)
+        self._values = None   # numpy array or list, allocated at the first value
+        self._numeric = False
+        self._shape = None    # shape of the numeric values
+        self._start = 0       # index of the oldest entry
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def _allocate(self, value):
+        if value is not None and not isinstance(value, str):
+            try:
+                a = np.asarray(value, dtype=float)
+                self._values = np.empty((self.capacity,) + a.shape, dtype=float)
+                self._numeric = True
+                self._shape = a.shape
+                return
+            except (TypeError, ValueError):
+                pass
+        self._values = [None] * self.capacity
+        self._numeric = False
+
+    def _to_list(self):
+        # a value does not fit the numeric storage: keep the values as objects
+        values = [None] * self.capacity
+        for i in range(self._size):
+            j = (self._start + i) % self.capacity
+            values[j] = self._values[j]
+        self._values = values
+        self._numeric = False
+        self._shape = None
+
+    def _fits(self, value):
+        # only numbers of the stored shape go in the numeric array (no broadcast or parsing)
+        if value is None or isinstance(value, str):
+            return False
+        try:
+            return np.shape(value) == self._shape
+        except (TypeError, ValueError):
+            return False
+
+    def append(self, t, value):
+        if self._values is None:
+            self._allocate(value)
+        if self._size > 0:
+            t = max(t, self._times[(self._start + self._size - 1) % self.capacity])
+        if self._size < self.capacity:
+            j = (self._start + self._size) % self.capacity
+            self._size += 1
+        else:
+            # overwrite the oldest entry
+            j = self._start
+            self._start = (self._start + 1) % self.capacity
+        self._times[j] = t
+        if self._numeric:
+            if self._fits(value):
+                try:
+                    self._values[j] = np.asarray(value, dtype=float)
+                    return
+                except (TypeError, ValueError):
+                    pass
+            self._to_list()
+        self._values[j] = value
+
+    def _time(self, i):
+        return self._times[(self._start + i) % self.capacity]
+
+    def _entry(self, i):
+        j = (self._start + i) % self.capacity
+        value = self._values[j]
+        if self._numeric:
+            value = value.copy() if isinstance(value, np.ndarray) else float(value)
+        return (float(self._times[j]), value)
+
+    def _bisect_right(self, t):
+        # number of entries with time <= t
+        lo, hi = 0, self._size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._time(mid) <= t:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _bisect_left(self, t):
+        # number of entries with time < t
+        lo, hi = 0, self._size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._time(mid) < t:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def value_at(self, t):
+        ''' (time, value) of the last change at or before t, None if older than the buffer '''
+        i = self._bisect_right(t)
+        if i == 0:
+            return None
+        return self._entry(i - 1)
+
+    def changes_between(self, t0, t1):
+        ''' [(time, value)] of the changes with t0 <= time <= t1 '''
+        return [self._entry(i) for i in range(self._bisect_left(t0), self._bisect_right(t1))]
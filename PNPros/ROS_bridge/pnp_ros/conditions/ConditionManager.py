@@ -1,108 +1,517 @@
 import os
+import re
+import sys
+import time
 import rospy
 import rosbag
 import inspect
-import fnmatch
+import threading
+import collections
+import concurrent.futures
 
 from AbstractCondition import AbstractCondition, ConditionListener
+from ConditionExpression import ExpressionCache, is_expression, parse_condition_literal
+from ConditionUpdateDispatcher import ConditionUpdateDispatcher
+from ConditionSnapshot import ConditionSnapshot
+from TemporalConditions import TemporalConditions, TEMPORAL_OPERATORS
 from importlib import util
 import std_msgs
 
+try:
+    sys.path.append(os.environ["PNP_HOME"] + '/scripts')
+except:
+    print("Please set PNP_HOME environment variable to PetriNetPlans folder.")
+    sys.exit(1)
+
+from pnp_plugins import discover_plugins, get_manifest_path, LazyPlugin, PluginReloader
+from pnp_common import TOPIC_CONDITIONUPDATE, TOPIC_PLANTOEXEC
+
 class ConditionManager(ConditionListener):
 
 
-    def __init__(self, conditions_folder=None):
-        self.blacklisted_conditions = ["LaserScan", "Twist", "Pose"]
+    def __init__(self, conditions_folder=None, plan_folder=None):
+        self._conditions_folder = conditions_folder
+        self._plan_folder = plan_folder
         self._condition_instances = {}
+        self._condition_plugins = {}
+        self._listeners = []
+        self._instances_lock = threading.RLock()
+        # held while a condition is instantiated
+        self._creation_locks = collections.defaultdict(threading.Lock)
+        # held while the conditions change and the snapshot is replaced
+        self._state_lock = threading.RLock()
+        # compiled boolean expressions of conditions
+        self._expressions = ExpressionCache(self.evaluate)
+        # delivers the updates of the conditions to the listeners
+        self._dispatcher = ConditionUpdateDispatcher(self._deliver_update)
+        # activation of the conditions: time of the last use, pinned
+        # conditions (never deactivated) and idle timeouts
+        self._last_used = {}
+        self._pins = collections.Counter()
+        self._plan_conditions = []
+        self._idle_timeouts = {}
+        self._history_sizes = {}
+        # values of the active conditions, replaced at every change, and log
+        # of the (version, condition name) of the last changes
+        self._snapshot = ConditionSnapshot()
+        self._changes = collections.deque(maxlen=1024)
+        # held_/rose_ operators, updated at the changes of the conditions
+        self._temporal = TemporalConditions(self.evaluate, self._last_change_time, self._notifies_changes)
 
-        # Initialize all the classes in current folder + the conditions_folder which implement AbstractCondition
-        directory = os.path.dirname(os.path.abspath(__file__))
-        potential_files = [os.path.join(dirpath, f)
-                    for dirpath, _, files in os.walk(directory, followlinks=True)
-                    for f in fnmatch.filter(files, '*.py')]
-        if conditions_folder is not None:
-            potential_files += [os.path.join(dirpath, f)
-                        for dirpath, _, files in os.walk(conditions_folder, followlinks=True)
-                        for f in fnmatch.filter(files, '*.py')]
-        for file in potential_files:
-        # for file in glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), "*.py")):
-
-            module_name = os.path.splitext(os.path.basename(file))[0]
-            # skip if blacklisted
-            if module_name in self.blacklisted_conditions:
-                continue
-
-            try:
-                spec = util.spec_from_file_location(module_name,file)
-                module = util.module_from_spec(spec)
-                spec.loader.exec_module(module)
-                
-                condition_class = getattr(module, module_name)
-                # condition_class = getattr(import_module(full_name, package=""), module_name)
-            except (ImportError, AttributeError) as e:
-                continue
-            else:
-                try:
-                    if issubclass(condition_class, AbstractCondition) and not inspect.isabstract(condition_class):
-                        # Instanciate the condition
-                        condition_instance = condition_class()
-
-                        self._condition_instances.update({
-                            module_name : condition_instance
-                        })
-
-                        rospy.loginfo("Initialized condition " + module_name)
-                    else:
-                        rospy.logwarn("Class " + module_name + " does not inherit from AbstractCondition or is Abstract")
-                except TypeError as e:
-                    rospy.logwarn(e)
-                    rospy.logwarn("Class " + module_name + " must inherit from AbstractCondition")
-                    pass
+        # Find all the classes in current folder + the conditions_folder which implement AbstractCondition.
+        # Files are only scanned here, a condition is imported and instantiated the first time it is used.
+        for (module_name, file) in self._search_conditions().items():
+            self._condition_plugins[module_name] = LazyPlugin(module_name, file, self._find_condition_implementation)
+            rospy.loginfo("Found condition " + module_name)
 
         # publish conditions updates
-        self.cond_update_pub = rospy.Publisher("/condition_update", std_msgs.msg.String, queue_size=10)
+        self.cond_update_pub = rospy.Publisher(TOPIC_CONDITIONUPDATE, std_msgs.msg.String, queue_size=10)
 
         # register itself as a listener of all the conditions
         self.register_condition_listener(self)
 
-    def evaluate(self, condition_name, params):
+        # activate the conditions referenced by the plan to execute
+        if self._plan_folder is not None:
+            rospy.Subscriber(TOPIC_PLANTOEXEC, std_msgs.msg.String, self._plan_to_exec_cb)
+
+    def _folders(self):
+        return [os.path.dirname(os.path.abspath(__file__)), self._conditions_folder]
+
+    def _search_conditions(self):
+        return discover_plugins(self._folders(), AbstractCondition.__name__,
+                                get_manifest_path("conditions"))
+
+    def reload_conditions(self, changed_files):
+        ''' Re-import the conditions defined in the changed files. The instantiated
+            conditions are replaced by instances of the new classes. '''
+        conditions_found = self._search_conditions()
+        with self._instances_lock:
+            plugins = dict(self._condition_plugins)
+            instances = dict(self._condition_instances)
+            old_instances = []
+            for cond_name in list(plugins.keys()):
+                if cond_name not in conditions_found:
+                    del plugins[cond_name]
+                    if cond_name in instances:
+                        old_instances.append(instances.pop(cond_name))
+                    rospy.loginfo("Removed condition " + cond_name)
+            for (cond_name, file) in conditions_found.items():
+                if cond_name in plugins and plugins[cond_name].path == file and file not in changed_files:
+                    continue
+                plugin = LazyPlugin(cond_name, file, self._find_condition_implementation)
+                condition_class = plugin.get()
+                if condition_class is None and cond_name in plugins:
+                    rospy.logwarn("Cannot reload condition " + cond_name + ", keeping the previous version")
+                    continue
+                plugins[cond_name] = plugin
+                if cond_name in instances:
+                    old_instances.append(instances[cond_name])
+                    instances[cond_name] = self._create_instance(cond_name, condition_class)
+                rospy.loginfo("Reloaded condition " + cond_name)
+            # swap the registries
+            self._condition_plugins = plugins
+            self._condition_instances = instances
+            for cond_name in [n for n in self._last_used if n not in plugins]:
+                del self._last_used[cond_name]
+        for instance in old_instances:
+            instance._on_change = None
+            instance.shutdown()
+        with self._state_lock:
+            for cond_name in self._snapshot.names():
+                if cond_name not in self._condition_instances:
+                    self._snapshot_remove(cond_name)
+
+    def start_reloader(self, period=2.0):
+        reloader = PluginReloader(self._folders(), self.reload_conditions, period)
+        reloader.start()
+        return reloader
+
+    @staticmethod
+    def _find_condition_implementation(file, module_name):
+        try:
+            spec = util.spec_from_file_location(module_name,file)
+            module = util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+
+            condition_class = getattr(module, module_name)
+        except (ImportError, AttributeError) as e:
+            rospy.logwarn("Cannot import condition " + module_name + ": " + str(e))
+            return None
         try:
-            res = self._condition_instances[condition_name].evaluate(params)
+            if issubclass(condition_class, AbstractCondition) and not inspect.isabstract(condition_class):
+                return condition_class
+            rospy.logwarn("Class " + module_name + " does not inherit from AbstractCondition or is Abstract")
+        except TypeError as e:
+            rospy.logwarn(e)
+            rospy.logwarn("Class " + module_name + " must inherit from AbstractCondition")
+        return None
+
+    def get_condition_instance(self, condition_name):
+        # instantiate (activate) the condition at the first request
+        self._touch(condition_name)
+        instance = self._condition_instances.get(condition_name)
+        if instance is None:
+            instance = self._instantiate(condition_name)
+            if instance is None:
+                return None
+        # the first users wait for the initial data (up to its init_timeout)
+        instance.wait_ready()
+        return instance
+
+    def _instantiate(self, condition_name):
+        plugin = self._condition_plugins.get(condition_name)
+        if plugin is None:
+            return None
+        with self._instances_lock:
+            creation_lock = self._creation_locks[condition_name]
+        # different conditions are instantiated in parallel
+        with creation_lock:
+            instance = self._condition_instances.get(condition_name)
+            if instance is not None:
+                return instance
+            condition_class = plugin.get()
+            if condition_class is None:
+                return None
+            condition_instance = self._create_instance(condition_name, condition_class)
+            with self._instances_lock:
+                if self._condition_plugins.get(condition_name) is not plugin:
+                    # reloaded in the meantime
+                    condition_instance.shutdown()
+                    return self._condition_instances.get(condition_name)
+                self._condition_instances[condition_name] = condition_instance
+            return condition_instance
+
+    ## activation of the conditions
+
+    def pin(self, condition_name):
+        ''' Activate the condition and keep it active until unpin '''
+        with self._instances_lock:
+            self._pins[condition_name] += 1
+        self._touch(condition_name)
+        return self._instantiate(condition_name)
+
+    def subscribe(self, condition_names=None, max_workers=8):
+        ''' Pin the conditions and instantiate them in background, for the listeners
+            of their updates. If condition_names is None, all the conditions of the
+            manifest without an idle timeout (e.g. not LaserScan).
+            Returns the names to pass to unsubscribe. '''
+        if condition_names is None:
+            condition_names = [cond_name for cond_name in self.get_condition_names()
+                               if self._kept_active(cond_name)]
+        condition_names = list(condition_names)
+        now = time.time()
+        with self._instances_lock:
+            for cond_name in condition_names:
+                self._pins[cond_name] += 1
+                self._touch(cond_name, now)
+        def instantiate():
+            with concurrent.futures.ThreadPoolExecutor(max_workers, thread_name_prefix="pnp_condition_init") as pool:
+                instances = list(pool.map(self._instantiate, condition_names))
+            for (cond_name, instance) in zip(condition_names, instances):
+                if instance is None:
+                    rospy.logwarn("Cannot activate condition " + cond_name)
+        thread = threading.Thread(target=instantiate, name="pnp_condition_subscribe")
+        thread.daemon = True
+        thread.start()
+        return condition_names
+
+    def _kept_active(self, condition_name):
+        # the condition has no idle timeout (e.g. not LaserScan), its class is imported
+        plugin = self._condition_plugins.get(condition_name)
+        condition_class = plugin.get() if plugin is not None else None
+        if condition_class is None:
+            return False
+        return self._idle_timeouts.get(condition_name, condition_class.idle_timeout) is None
+
+    def unsubscribe(self, condition_names):
+        for cond_name in condition_names:
+            self.unpin(cond_name)
+
+    def unpin(self, condition_name):
+        with self._instances_lock:
+            if self._pins[condition_name] > 0:
+                self._pins[condition_name] -= 1
+            if self._pins[condition_name] == 0:
+                del self._pins[condition_name]
+        self._touch(condition_name)
+
+    def _touch(self, condition_name, now=None):
+        # time of the last use, kept only for the conditions of the manifest
+        if condition_name in self._condition_plugins:
+            self._last_used[condition_name] = now if now is not None else time.time()
+
+    def set_idle_timeout(self, condition_name, idle_timeout):
+        self._idle_timeouts[condition_name] = idle_timeout
+
+    def deactivate(self, condition_name, idle_timeout=None):
+        ''' Release the condition (e.g. unsubscribe), it is activated again at the next use.
+            With idle_timeout, only if it is still unused for more than idle_timeout. '''
+        with self._instances_lock:
+            if condition_name in self._pins:
+                return False
+            if idle_timeout is not None and time.time() - self._last_used.get(condition_name, 0) <= idle_timeout:
+                # used (or pinned and released) since the check of the reaper
+                return False
+            instance = self._condition_instances.pop(condition_name, None)
+            self._last_used.pop(condition_name, None)
+        if instance is None:
+            return False
+        instance._on_change = None
+        instance.shutdown()
+        with self._state_lock:
+            self._snapshot_remove(condition_name)
+        self._temporal.forget(condition_name)
+        rospy.loginfo("Deactivated condition " + condition_name)
+        return True
+
+    def deactivate_idle(self):
+        # deactivate the conditions not used for more than their idle_timeout
+        now = time.time()
+        for (cond_name, instance) in list(self._condition_instances.items()):
+            idle_timeout = self._idle_timeouts.get(cond_name, instance.idle_timeout)
+            if idle_timeout is None or cond_name in self._pins:
+                continue
+            if now - self._last_used.get(cond_name, 0) > idle_timeout:
+                self.deactivate(cond_name, idle_timeout)
+
+    def start_reaper(self, period=1.0):
+        def run():
+            while not rospy.is_shutdown():
+                time.sleep(period)
+                try:
+                    self.deactivate_idle()
+                except Exception as e:
+                    rospy.logerr("Error deactivating the idle conditions: %s" % e)
+        reaper = threading.Thread(target=run, name="pnp_condition_reaper")
+        reaper.daemon = True
+        reaper.start()
+        return reaper
+
+    def get_plan_conditions(self, plan_name):
+        ''' Names of the conditions referenced by the plan and by its ERs '''
+        names = sorted(self.get_condition_names(), key=len, reverse=True)
+        if not names:
+            return []
+        # a literal is <name>[_<params>], possibly inside held_<seconds>_/rose_<seconds>_:
+        # a name preceded by another identifier (e.g. the params of an action) is not a literal
+        literal_re = re.compile(r"(?<![A-Za-z0-9_.])(?:(?:%s)_[0-9.]+_)?(%s)(?![A-Za-z0-9])"
+                                % ("|".join(TEMPORAL_OPERATORS), "|".join(map(re.escape, names))))
+        found = set()
+        for ext in (".pnml", ".plan", ".er"):
+            path = os.path.join(self._plan_folder, plan_name + ext)
+            if not os.path.isfile(path):
+                continue
+            with open(path) as f:
+                found.update(literal_re.findall(f.read()))
+        return sorted(found)
+
+    def _plan_to_exec_cb(self, data):
+        plan_name = data.data
+        if plan_name == "<currentplan>":
+            return
+        conditions = [] if plan_name == "stop" else self.get_plan_conditions(plan_name)
+        # the conditions of the new plan are pinned before releasing the previous ones
+        for cond_name in conditions:
+            self.pin(cond_name)
+        for cond_name in self._plan_conditions:
+            self.unpin(cond_name)
+        self._plan_conditions = conditions
+        if conditions:
+            rospy.loginfo("Activated conditions of plan " + plan_name + ": " + " ".join(conditions))
+
+    def preload(self, condition_names=None, max_workers=8):
+        ''' Instantiate the conditions in parallel (all of them if condition_names is None),
+            waiting for their initial data at the same time '''
+        if condition_names is None:
+            condition_names = self.get_condition_names()
+        with concurrent.futures.ThreadPoolExecutor(max_workers, thread_name_prefix="pnp_condition_init") as pool:
+            instances = list(pool.map(self.get_condition_instance, condition_names))
+        for (cond_name, instance) in zip(condition_names, instances):
+            if instance is None:
+                rospy.logwarn("Cannot preload condition " + cond_name)
+
+    def _create_instance(self, condition_name, condition_class):
+        # Instanciate the condition
+        condition_instance = condition_class()
+        condition_instance._state_lock = self._state_lock
+        if condition_name in self._history_sizes:
+            condition_instance.enable_history(self._history_sizes[condition_name])
+        with self._state_lock:
+            condition_instance._on_change = self._condition_changed
+            self._condition_changed(condition_instance)
+        # the held_/rose_ monitors get every change, the listeners get the
+        # updates through the dispatcher
+        if condition_instance.notifies_changes:
+            condition_instance.register_updates_listener(self._temporal)
+        condition_instance.register_updates_listener(self._dispatcher)
+        rospy.loginfo("Initialized condition " + condition_name)
+        return condition_instance
+
+    def get_condition_names(self):
+        return list(self._condition_plugins.keys())
+
+    def evaluate(self, condition_name, params, snapshot=None):
+        ''' Truth value of the condition on its state in the snapshot (the
+            current state if snapshot is None) '''
+        if condition_name in TEMPORAL_OPERATORS:
+            return self._temporal.evaluate(condition_name, params)
+        condition_instance = self.get_condition_instance(condition_name)
+        if condition_instance is not None:
+            if snapshot is None:
+                res = condition_instance.evaluate_memoized(params)
+            else:
+                res = condition_instance.evaluate_snapshot(snapshot, params)
             #rospy.loginfo("Evaluating condition " + condition_name + " " + str(params) + ": " + str(res))
             return res
-        except KeyError:
+        else:
             rospy.logwarn("Condition " + condition_name + " not implemented")
             # return true when the condition is not implemented, to avoid loops..
             return True
 
+    def evaluate_condition(self, cond, snapshot=None):
+        # cond is a literal (name_params) or a boolean expression of literals,
+        # evaluated on the snapshot (the current one if None) without locks
+        if snapshot is None:
+            snapshot = self._snapshot
+        if is_expression(cond):
+            try:
+                expression = self._expressions.get(cond)
+            except ValueError as e:
+                rospy.logwarn(str(e))
+            else:
+                return expression(snapshot)
+        (name, params) = parse_condition_literal(cond)
+        return self.evaluate(name, params, snapshot)
+
+    def evaluate_batch(self, conds):
+        # evaluate all the conditions on the same snapshot, without blocking
+        # the updates of the conditions (e.g. during service calls)
+        snapshot = self._snapshot
+        return [self.evaluate_condition(cond, snapshot) for cond in conds]
+
     def get_value(self, condition_name):
-        try:
-            res = self._condition_instances[condition_name].get_value()
+        condition_instance = self.get_condition_instance(condition_name)
+        if condition_instance is not None:
+            snapshot = self._snapshot
+            if condition_name in snapshot:
+                res = snapshot.get_value(condition_name)
+            else:
+                res = condition_instance.get_value()
             #rospy.loginfo("Geting value of condition " + condition_name + ": " + res)
             return res
-        except KeyError:
+        else:
             rospy.logwarn("Condition " + condition_name + " not implemented")
             # return true when the condition is not implemented, to avoid loops..
             return None
 
-    def register_condition_listener(self, listener):
-        for (cond_name, cond_instance) in self._condition_instances.items():
-            # Register this class as updater listener
-            if issubclass(cond_instance.__class__, AbstractCondition):
-                cond_instance.register_updates_listener(listener)
-                rospy.loginfo(listener.__class__.__name__ + " registered as listener of "\
-                            + cond_name)
+    def register_condition_listener(self, listener, subscribe=None):
+        # the listener gets the updates of all the conditions, also the ones instantiated later;
+        # the conditions in subscribe (all the ones without idle timeout if True) are activated now and kept active
+        if not issubclass(listener.__class__, ConditionListener):
+            rospy.logwarn("Object " + str(listener.__class__) + " is not a ConditionListener subclass, cannot be registered as listener")
+            return
+        with self._instances_lock:
+            self._listeners = self._listeners + [listener]
+        if subscribe:
+            self.subscribe(None if subscribe is True else subscribe)
+        rospy.loginfo(listener.__class__.__name__ + " registered as listener of the conditions")
+
+    def set_update_policy(self, condition_name, max_rate=None, min_delta=None):
+        self._dispatcher.set_policy(condition_name, max_rate, min_delta)
 
-    # Return a list with the current state of all the conditions
+    def _deliver_update(self, condition_instance):
+        # called by the dispatcher thread
+        for listener in self._listeners:
+            try:
+                listener.receive_update(condition_instance)
+            except Exception as e:
+                rospy.logerr("Error in listener " + listener.__class__.__name__ + ": " + str(e))
+
+    # Return a list with the current state of all the active conditions
     def get_conditions_dump(self):
-        condition_dump = []
-        for (cond_name, cond_instance) in self._condition_instances.items():
-            condition_dump.append(cond_name + "_" + str(cond_instance.get_value()))
+        return list(self._snapshot.dump())
+
+    ## versioned snapshots of the conditions
+
+    def snapshot(self):
+        ''' Current ConditionSnapshot (immutable) '''
+        return self._snapshot
+
+    ## history of the conditions
+
+    def set_history_size(self, condition_name, size):
+        ''' Number of changes kept in the history of the condition (0 disables it) '''
+        self._history_sizes[condition_name] = size
+        instance = self._condition_instances.get(condition_name)
+        if instance is not None:
+            instance.enable_history(size)
+
+    def _history(self, condition_name):
+        instance = self.get_condition_instance(condition_name)
+        if instance is None or instance.history is None:
+            rospy.logwarn("Condition " + condition_name + " has no history")
+            return None
+        return instance.history
+
+    def value_at(self, condition_name, t):
+        ''' (time, value) of the condition at time t (ROS time in seconds), None if unknown '''
+        history = self._history(condition_name)
+        if history is None:
+            return None
+        with self._state_lock:
+            return history.value_at(t)
+
+    def changes_between(self, condition_name, t0, t1):
+        ''' [(time, value)] of the changes of the condition between t0 and t1 '''
+        history = self._history(condition_name)
+        if history is None:
+            return []
+        with self._state_lock:
+            return history.changes_between(t0, t1)
+
+    def changes_since(self, version):
+        ''' (snapshot, names of the conditions changed after version). The names
+            are None if the version is older than the change log: read the
+            whole snapshot then. Removed conditions are not in the snapshot. '''
+        with self._state_lock:
+            snapshot = self._snapshot
+            if version >= snapshot.version:
+                return snapshot, set()
+            if not self._changes or self._changes[0][0] > version + 1:
+                return snapshot, None
+            changed = set()
+            for (change_version, cond_name) in reversed(self._changes):
+                if change_version <= version:
+                    break
+                changed.add(cond_name)
+            return snapshot, changed
+
+    def _condition_changed(self, condition_instance):
+        # called by the condition holding _state_lock
+        cond_name = condition_instance.__class__.__name__
+        self._snapshot = self._snapshot.with_value(cond_name, condition_instance.get_typed_value(),
+                                                   condition_instance._render_value,
+                                                   condition_instance._snapshot_state())
+        self._changes.append((self._snapshot.version, cond_name))
+
+    def _last_change_time(self, cond_name):
+        instance = self._condition_instances.get(cond_name)
+        return instance.last_change_time if instance is not None else None
+
+    def _notifies_changes(self, cond_name):
+        instance = self.get_condition_instance(cond_name)
+        return instance is not None and instance.notifies_changes
 
-        return condition_dump
+    def _snapshot_remove(self, cond_name):
+        if cond_name in self._snapshot:
+            self._snapshot = self._snapshot.without(cond_name)
+            self._changes.append((self._snapshot.version, cond_name))
 
 
     def receive_update(self, condition_instance):
+        # the value is rendered only if someone is listening
+        if self.cond_update_pub.get_num_connections() == 0:
+            return
         try:
             self.cond_update_pub.publish(condition_instance.get_name() + "_" + str(condition_instance.get_value()))
         except Exception as e:
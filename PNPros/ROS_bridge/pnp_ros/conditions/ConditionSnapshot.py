@@ -0,0 +1,55 @@
+class ConditionSnapshot(object):
+    ''' Immutable view of the values of the active conditions at a version.
+
+        ConditionManager replaces it (copy-on-write) when a condition changes,
+        so readers get a consistent state without locks. The values are
+        rendered as strings only when asked, once per snapshot. The state of
+        each condition (AbstractCondition._snapshot_state) is kept to evaluate
+        the condition on the snapshot. '''
+
+    def __init__(self, version=0, values=None):
+        self.version = version
+        self._values = values if values is not None else {}  # name -> (typed value, render, state)
+        self._rendered = {}
+        self._dump = None
+
+    def __contains__(self, condition_name):
+        return condition_name in self._values
+
+    def __len__(self):
+        return len(self._values)
+
+    def names(self):
+        return list(self._values.keys())
+
+    def get_typed_value(self, condition_name):
+        return self._values[condition_name][0]
+
+    def get_state(self, condition_name):
+        return self._values[condition_name][2]
+
+    def get_value(self, condition_name):
+        ''' Same value of AbstractCondition.get_value '''
+        if condition_name in self._rendered:
+            return self._rendered[condition_name]
+        (value, render, _) = self._values[condition_name]
+        if value is not None and not isinstance(value, str):
+            value = render(value)
+        self._rendered[condition_name] = value
+        return value
+
+    def dump(self):
+        ''' List of name_value of the conditions (shared, do not modify it) '''
+        if self._dump is None:
+            self._dump = [name + "_" + str(self.get_value(name)) for name in self._values]
+        return self._dump
+
+    def with_value(self, condition_name, value, render, state=None):
+        values = dict(self._values)
+        values[condition_name] = (value, render, state)
+        return ConditionSnapshot(self.version + 1, values)
+
+    def without(self, condition_name):
+        values = dict(self._values)
+        del values[condition_name]
+        return ConditionSnapshot(self.version + 1, values)
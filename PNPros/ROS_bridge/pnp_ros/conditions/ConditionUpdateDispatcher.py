@@ -0,0 +1,109 @@
+import time
+import heapq
+import threading
+import rospy
+from AbstractCondition import ConditionListener
+
+
+class ConditionUpdateDispatcher(ConditionListener):
+    ''' Delivers the updates of the conditions to the listeners from its own
+        thread, so that a slow listener does not stall the topic callbacks.
+
+        The updates of a condition waiting to be delivered are coalesced (the
+        listeners read the latest value), at most max_rate updates per second
+        are delivered and, if min_delta is set, the updates closer than
+        min_delta to the last delivered value are dropped. The policies are
+        the update_max_rate/update_min_delta attributes of the condition,
+        overridden by set_policy. '''
+
+    def __init__(self, deliver):
+        self._deliver = deliver
+        self._policies = {}
+        self._cv = threading.Condition()
+        self._pending = {}    # condition name -> instance to deliver
+        self._due = []        # heap of (time, seq, condition name)
+        self._last_sent = {}  # condition name -> (time, typed value)
+        self._seq = 0
+        self._running = True
+
+        # counters
+        self.delivered = 0
+        self.coalesced = 0
+        self.dropped = 0
+
+        self._thread = threading.Thread(target=self._run, name="pnp_condition_updates")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def set_policy(self, condition_name, max_rate=None, min_delta=None):
+        self._policies[condition_name] = (max_rate, min_delta)
+
+    def _policy(self, condition_instance, condition_name):
+        return self._policies.get(condition_name,
+                                  (condition_instance.update_max_rate, condition_instance.update_min_delta))
+
+    def receive_update(self, condition_instance):
+        # called by the topic callbacks: only queue the update
+        name = condition_instance.get_name()
+        max_rate = self._policy(condition_instance, name)[0]
+        with self._cv:
+            if name in self._pending:
+                # the queued update will read the latest value
+                self._pending[name] = condition_instance
+                self.coalesced += 1
+                return
+            self._pending[name] = condition_instance
+            due = time.time()
+            last = self._last_sent.get(name)
+            if max_rate and last is not None:
+                due = max(due, last[0] + 1.0 / max_rate)
+            heapq.heappush(self._due, (due, self._seq, name))
+            self._seq += 1
+            self._cv.notify()
+
+    def _next(self):
+        with self._cv:
+            while self._running:
+                if self._due:
+                    wait = self._due[0][0] - time.time()
+                    if wait <= 0:
+                        name = heapq.heappop(self._due)[2]
+                        return name, self._pending.pop(name)
+                    self._cv.wait(wait)
+                else:
+                    self._cv.wait()
+        return None, None
+
+    def _run(self):
+        while True:
+            name, condition_instance = self._next()
+            if condition_instance is None:
+                return
+
+            min_delta = self._policy(condition_instance, name)[1]
+            value = None
+            if hasattr(condition_instance, "get_typed_value"):
+                value = condition_instance.get_typed_value()
+            last = self._last_sent.get(name)
+            if min_delta is not None and last is not None and value is not None \
+                    and not condition_instance._value_changed(last[1], value, min_delta):
+                self.dropped += 1
+                continue
+
+            with self._cv:
+                self._last_sent[name] = (time.time(), value)
+            try:
+                self._deliver(condition_instance)
+                self.delivered += 1
+            except Exception as e:
+                rospy.logerr("Error delivering update of condition %s: %s" % (name, e))
+
+    def stats(self):
+        with self._cv:
+            return {"pending": len(self._pending), "delivered": self.delivered,
+                    "coalesced": self.coalesced, "dropped": self.dropped}
+
+    def close(self):
+        with self._cv:
+            self._running = False
+            self._cv.notify()
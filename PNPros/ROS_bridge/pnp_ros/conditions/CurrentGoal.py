@@ -11,11 +11,11 @@ class CurrentGoal(AbstractTopicCondition):
     def _get_value_from_data(self, data):
         return '_'.join([data.goal.name, data.goal.params])
 
-    def evaluate(self, params):
+    def evaluate_value(self, value, data, params):
         node = '_'.join(params)
 
-        if self.last_value:
-            current_goal = self.last_value
+        if value:
+            current_goal = value
 
             return node == current_goal
         else:
@@ -11,11 +11,11 @@ class CurrentNavigationGoal(AbstractTopicCondition):
     def _get_value_from_data(self, data):
         return data.goal.target
 
-    def evaluate(self, params):
+    def evaluate_value(self, value, data, params):
         node = str(params[0])
 
-        if self.last_data:
-            current_goal = self.last_value
+        if data:
+            current_goal = value
 
             return node == current_goal
         else:
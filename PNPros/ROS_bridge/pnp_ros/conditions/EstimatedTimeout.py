@@ -1,7 +1,6 @@
 import rospy
 from AbstractServiceCondition import AbstractServiceCondition
 from strands_navigation_msgs.srv import EstimateTravelTime
-from pnp_msgs.srv import PNPConditionValue
 
 class EstimatedTimeout(AbstractServiceCondition):
 
@@ -12,12 +11,12 @@ class EstimatedTimeout(AbstractServiceCondition):
     _ADDITIVE_CONSTANT_TIMEOUT = rospy.Duration.from_sec(5)
 
     def evaluate(self, params):
-        condition_value_sp = rospy.ServiceProxy("/PNPConditionValue", PNPConditionValue)
+        conditions = self.conditions()
 
-        current_node = condition_value_sp("CurrentNode").value
-        current_goal = condition_value_sp("CurrentGoal").value
-        goal_starting_time = condition_value_sp("GoalStartingTime").value
-        current_nav_goal = condition_value_sp("CurrentNavigationGoal").value
+        current_node = conditions.get_value("CurrentNode")
+        current_goal = conditions.get_value("CurrentGoal")
+        goal_starting_time = conditions.get_value("GoalStartingTime")
+        current_nav_goal = conditions.get_value("CurrentNavigationGoal")
 
         if current_goal.split('_')[0] == "goto" :
 
@@ -9,18 +9,22 @@ class FailureSituation(AbstractTopicCondition):
 
     _topic_type = ActionFailure
 
+    # the result depends on the age of the signal, it changes without a message
+    memoize = False
+    notifies_changes = False
+
     def _get_value_from_data(self, data):
         return data.cause
 
-    def evaluate(self, params):
+    def evaluate_value(self, value, data, params):
         cause = None
         if len(params) > 0:
             cause = str(params[0])
 
-        if self.last_data is not None:
-            if (rospy.Time.now().to_sec() - self.last_data.stamp.to_sec()) < 0.5:
+        if data is not None:
+            if (rospy.Time.now().to_sec() - data.stamp.to_sec()) < 0.5:
                 if cause is not None:
-                    return cause == self.last_value
+                    return cause == value
                 else:
                     return True
 
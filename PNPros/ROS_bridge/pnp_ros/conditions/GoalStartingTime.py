@@ -11,11 +11,11 @@ class GoalStartingTime(AbstractTopicCondition):
     def _get_value_from_data(self, data):
         return str(data.goal_id.stamp.to_sec())
 
-    def evaluate(self, params):
+    def evaluate_value(self, value, data, params):
         time = float(params[0])
 
-        if self.last_data:
-            starting_time = float(self.last_value)
+        if data:
+            starting_time = float(value)
 
             return time == starting_time
         else:
@@ -1,4 +1,5 @@
 from AbstractTopicCondition import AbstractTopicCondition
+import numpy as np
 import sensor_msgs
 
 class LaserScan(AbstractTopicCondition):
@@ -7,10 +8,28 @@ class LaserScan(AbstractTopicCondition):
 
     _topic_type = sensor_msgs.msg.LaserScan
 
+    # meters
+    change_threshold = 0.01
+    update_max_rate = 10
+    idle_timeout = 30.0
+    history_size = 0
+
     def _get_value_from_data(self, data):
 
-        return str(data.ranges)
+        return np.asarray(data.ranges, dtype=float)
+
+    @staticmethod
+    def _parse_ranges(params):
+        # ranges as rendered by get_value, "(r1, r2, ...)", or one per parameter
+        text = ",".join(params).strip("()[] ")
+        try:
+            return np.asarray([float(r) for r in text.split(",") if r.strip()], dtype=float)
+        except ValueError:
+            return None
 
-    def evaluate(self, params):
+    def evaluate_value(self, value, data, params):
 
-        return params == self.last_value
+        ranges = self._parse_ranges(params)
+        if value is None or ranges is None or ranges.shape != value.shape:
+            return False
+        return np.allclose(value, ranges, rtol=0, atol=self.change_threshold, equal_nan=True)
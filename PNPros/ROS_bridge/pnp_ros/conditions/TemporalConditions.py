@@ -0,0 +1,110 @@
+import threading
+import collections
+import rospy
+
+from AbstractCondition import ConditionListener
+
+# held_<seconds>_<literal>: the literal is true since at least <seconds>
+# rose_<seconds>_<literal>: the literal became true in the last <seconds>
+TEMPORAL_OPERATORS = ("held", "rose")
+
+
+class TemporalMonitor(object):
+    ''' Truth value of a condition literal and the times of its last rising
+        edge, updated at each change of the condition '''
+
+    def __init__(self, value, since):
+        self.value = value
+        # a literal already true is taken as risen at the last change of the condition
+        self.true_since = since if value else None
+        self.last_rise = since if value else None
+
+    def update(self, value, t):
+        if value and not self.value:
+            self.true_since = t
+            self.last_rise = t
+        elif not value:
+            self.true_since = None
+        self.value = value
+
+    def held(self, duration, now):
+        return self.true_since is not None and now - self.true_since >= duration
+
+    def rose(self, duration, now):
+        return self.last_rise is not None and now - self.last_rise <= duration
+
+
+class TemporalConditions(ConditionListener):
+    ''' Evaluates the temporal operators in O(1) from monitors of the inner
+        literals, created at the first evaluation and updated by the changes
+        of their condition (registered as its updates listener, the literals
+        are evaluated out of the state lock). Only the conditions that
+        notify their changes can be used. '''
+
+    def __init__(self, evaluate, last_change_time, notifies_changes):
+        self._evaluate = evaluate                  # (name, params) -> truth value
+        self._last_change_time = last_change_time  # name -> time of the last change or None
+        self._notifies_changes = notifies_changes  # name -> True if the condition notifies its changes
+        self._lock = threading.Lock()
+        self._monitors = {}                        # (name, params) -> monitor
+        self._by_condition = collections.defaultdict(list)  # name -> keys of its monitors
+        self._rejected = set()
+
+    def _monitor(self, cond_name, cond_params):
+        key = (cond_name, tuple(cond_params))
+        monitor = self._monitors.get(key)
+        if monitor is not None:
+            return monitor
+        if not self._notifies_changes(cond_name):
+            if cond_name not in self._rejected:
+                self._rejected.add(cond_name)
+                rospy.logwarn("Condition %s does not notify its changes, it cannot be used in held_/rose_ conditions" % cond_name)
+            return None
+        since = self._last_change_time(cond_name)
+        value = bool(self._evaluate(cond_name, cond_params))
+        monitor = TemporalMonitor(value, since if since is not None else rospy.get_time())
+        with self._lock:
+            if key in self._monitors:
+                return self._monitors[key]
+            self._monitors[key] = monitor
+            self._by_condition[cond_name].append(key)
+        # a change between the evaluation and the registration is not notified to the monitor
+        last = self._last_change_time(cond_name)
+        if last != since:
+            self._update(monitor, cond_name, cond_params, last)
+        return monitor
+
+    def _update(self, monitor, cond_name, cond_params, t):
+        value = bool(self._evaluate(cond_name, cond_params))
+        with self._lock:
+            monitor.update(value, t if t is not None else rospy.get_time())
+
+    def evaluate(self, operator, params):
+        try:
+            duration = float(params[0])
+            cond_name, cond_params = params[1], params[2:]
+        except (IndexError, ValueError):
+            rospy.logwarn("Wrong temporal condition %s_%s" % (operator, "_".join(params)))
+            return False
+        monitor = self._monitor(cond_name, cond_params)
+        if monitor is None:
+            return False
+        now = rospy.get_time()
+        with self._lock:
+            if operator == "held":
+                return monitor.held(duration, now)
+            return monitor.rose(duration, now)
+
+    def receive_update(self, condition_instance):
+        # called by the condition after the change, out of its state lock
+        cond_name = condition_instance.get_name()
+        with self._lock:
+            monitors = [(key[1], self._monitors[key]) for key in self._by_condition.get(cond_name, [])]
+        for (cond_params, monitor) in monitors:
+            self._update(monitor, cond_name, list(cond_params), condition_instance.last_change_time)
+
+    def forget(self, cond_name):
+        # the condition is deactivated: its monitors are created again at the next use
+        with self._lock:
+            for key in self._by_condition.pop(cond_name, []):
+                del self._monitors[key]
@@ -9,15 +9,23 @@ class Twist(AbstractTopicCondition):
 
     _topic_type = Odometry
 
+    change_threshold = 0.001
+    update_max_rate = 10
+    idle_timeout = 30.0
+    history_size = 0
+
     def _get_value_from_data(self, data):
-        return str((
+        return (
                 data.twist.twist.linear.x,
                 data.twist.twist.angular.z
-            ))
+            )
 
-    def evaluate(self, params):
+    def evaluate_value(self, value, data, params):
+        # typed value of the condition
+        t1 = value
+        if t1 is None:
+            return False
         try:
-            t1 = make_tuple(self.last_value)
             t2 = make_tuple(str(params))
         except ValueError:
             return False
@@ -17,13 +17,19 @@ except:
     sys.exit(1)
 
 from ActionManager import ActionManager
+from AbstractAction import AbstractAction, ActionExecutor
 from ConditionManager import ConditionManager
+from AbstractCondition import ConditionListener
+from AbstractServiceCondition import AbstractServiceCondition
+from pnp_condition_client import LocalConditionClient, set_condition_client
 from pnp_msgs.msg import PNPActionFeedback, PNPResult, PNPAction
 from pnp_msgs.srv import (
     PNPCondition,
     PNPConditionResponse,
     PNPConditionValue,
     PNPConditionValueResponse,
+    PNPConditionBatch,
+    PNPConditionBatchResponse,
 )
 
 import pnp_common
@@ -71,27 +77,30 @@ class PNPActionServer(object):
             actionManager.end_action(goalhandler)
 
 
-def handle_PNPConditionEval(req):
-    cond_elems = req.cond.split("_")
-    cond = cond_elems[0]
-    params = cond_elems[1:]
+class GoalConditionForwarder(ConditionListener):
+    # wakes up the actions waiting on the updated condition, without the topic
+    def receive_update(self, condition_instance):
+        AbstractAction.goal_watcher.notify(condition_instance.get_name())
+
 
-    # evaluate through the condition manager
-    cond_truth_value = conditionManager.evaluate(cond, params)
+def handle_PNPConditionEval(req):
+    # evaluate through the condition manager (a literal or an and/or/not expression),
+    # on the current snapshot of the conditions
+    cond_truth_value = conditionManager.evaluate_condition(req.cond)
 
     if cond_truth_value:
-        rospy.loginfo(
-            "Eval condition: "
-            + cond
-            + " "
-            + " ".join(params)
-            + " value: "
-            + str(cond_truth_value)
-        )
+        rospy.loginfo("Eval condition: " + req.cond + " value: " + str(cond_truth_value))
 
     return PNPConditionResponse(cond_truth_value)
 
 
+def handle_PNPConditionBatchEval(req):
+    # all the conditions are evaluated on the same snapshot of the ConditionManager
+    truth_values = conditionManager.evaluate_batch(req.conds)
+
+    return PNPConditionBatchResponse([1 if v else 0 for v in truth_values])
+
+
 def handle_PNPConditionValue(req):
     cond = req.cond
 
@@ -111,12 +120,71 @@ if __name__ == "__main__":
     actions_folder = rospy.get_param("~actions_folder")
     conditions_folder = rospy.get_param("~conditions_folder")
 
-    conditionManager = ConditionManager(conditions_folder)
+    # bounded pool of threads for the action bodies
+    max_queued = rospy.get_param("~action_max_queued", -1)
+    AbstractAction.executor = ActionExecutor(
+        max_workers=rospy.get_param("~action_max_workers", 32),
+        max_queued=max_queued if max_queued >= 0 else None)
+    for (action_name, max_concurrency) in rospy.get_param("~action_max_concurrency", {}).items():
+        AbstractAction.executor.set_class_limit(action_name, max_concurrency)
+
+    # service conditions reuse their results for this time (0 to disable)
+    AbstractServiceCondition.memo_ttl = rospy.get_param("~service_condition_memo_ttl", 0.1)
+
+    # the conditions referenced by the plans in this folder are activated when the plan starts
+    plan_folder = rospy.get_param("~plan_folder", None)
+
+    conditionManager = ConditionManager(conditions_folder, plan_folder)
+
+    # conditions not used for their idle timeout are deactivated (0 to disable)
+    for (cond_name, idle_timeout) in rospy.get_param("~condition_idle_timeouts", {}).items():
+        conditionManager.set_idle_timeout(cond_name, idle_timeout)
+    # size of the history of the changes of the conditions, e.g. {Pose: 1000, CurrentNode: 0}
+    for (cond_name, history_size) in rospy.get_param("~condition_history", {}).items():
+        conditionManager.set_history_size(cond_name, history_size)
+
+    idle_check_period = rospy.get_param("~condition_idle_check_period", 1.0)
+    if idle_check_period > 0:
+        conditionManager.start_reaper(idle_check_period)
+
+    # rate and min change of the updates of the conditions sent to the listeners,
+    # e.g. {LaserScan: {max_rate: 5}, Pose: {min_delta: 0.05}}
+    for (cond_name, policy) in rospy.get_param("~condition_update_policies", {}).items():
+        conditionManager.set_update_policy(cond_name, policy.get("max_rate"), policy.get("min_delta"))
+
+    # conditions activated at startup and never deactivated (e.g. to get their updates)
+    pinned_conditions = rospy.get_param("~pinned_conditions", [])
+    if pinned_conditions:
+        conditionManager.subscribe(pinned_conditions)
+
+    # conditions instantiated in parallel at startup (true for all of them),
+    # the others are instantiated at their first use
+    preload_conditions = rospy.get_param("~preload_conditions", [])
+    if preload_conditions:
+        conditionManager.preload(None if preload_conditions is True else preload_conditions,
+                                 rospy.get_param("~preload_workers", 8))
+
+    # actions and conditions hosted here read the ConditionManager directly
+    set_condition_client(LocalConditionClient(conditionManager))
+    AbstractAction.goal_watcher.local_updates = True
+    AbstractAction.goal_watcher.pin = conditionManager.pin
+    AbstractAction.goal_watcher.unpin = conditionManager.unpin
+    conditionManager.register_condition_listener(GoalConditionForwarder())
+
     actionManager = ActionManager(actions_folder)
 
+    # reload the actions and conditions when their files change (0 to disable)
+    reload_period = rospy.get_param("~plugins_reload_period", 2.0)
+    if reload_period > 0:
+        conditionManager.start_reloader(reload_period)
+        actionManager.start_reloader(reload_period)
+
     # Service which returns truth value of condition
     rospy.Service(SRV_PNPCONDITIONEVAL, PNPCondition, handle_PNPConditionEval)
 
+    # Service which returns truth values of a list of conditions
+    rospy.Service(SRV_PNPCONDITIONBATCHEVAL, PNPConditionBatch, handle_PNPConditionBatchEval)
+
     # Service which returns value of condition
     rospy.Service(SRV_PNPCONDITIONVALUE, PNPConditionValue, handle_PNPConditionValue)
 
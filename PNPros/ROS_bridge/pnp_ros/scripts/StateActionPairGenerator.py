@@ -1,21 +1,186 @@
 import os
+import time
 import rospy, rosbag
+import threading
+import collections
 import multiprocessing
+try:
+    import queue
+except ImportError:
+    import Queue as queue
 from AbstractCondition import ConditionListener
 from pnp_msgs.srv import PNPStartStateActionSaver, PNPStartStateActionSaverResponse,\
                          PNPStopStateActionSaver, PNPStopStateActionSaverResponse
 
+class DemonstrationRecorder(object):
+    ''' State-action timesteps of a demonstration, stored by columns.
+
+        A condition is in all the timesteps from the first one up to the last
+        one where it was seen, so each column is a list of runs of timesteps
+        (first row, last row, seq, entry) and a new value only appends a run
+        or a row. seq orders the entries inside a timestep. Removed timesteps
+        are dropped from the list of alive row ids.
+
+        pop_final_lines returns the timesteps that cannot change anymore
+        (all the state conditions are there and their actions are fixed) and
+        forgets them. A state condition seen for the first time after that is
+        not added to the timesteps already returned. A requested state
+        condition never seen blocks pop_final_lines: add its current value
+        when the recording starts. '''
+
+    def __init__(self, state_conditions, action_conditions):
+        self.state_conditions = list(state_conditions)
+        self.action_conditions = list(action_conditions)
+        self._state_names = set(state_conditions)
+        self._columns = {}    # condition name -> runs [(first row, last row, seq, entry)]
+        self._last_seen = {}  # condition name -> last row with the condition
+        self._actions = {}    # row id -> executed actions
+        self._alive = []      # ids of the rows not removed, from position _first
+        self._first = 0
+        self._next_row = 0
+        self._popped_row = -1         # last row returned by pop_final_lines
+        self._last_with_actions = -1  # last row with actions
+        self._seq = 0
+
+    def is_state_condition(self, condition_name):
+        # all the conditions are state conditions if none is requested
+        return condition_name in self._state_names or len(self._state_names) == 0
+
+    def add_state(self, condition_name, entry):
+        self._seq += 1
+        last_row = self._alive[-1] if len(self._alive) > self._first else None
+        seen = self._last_seen.get(condition_name, -1)
+        if last_row is None or seen == last_row:
+            # the condition was updated in the last timestep: new timestep
+            row = self._next_row
+            self._next_row += 1
+            self._actions[row] = []
+            self._alive.append(row)
+            self._add_run(condition_name, row, row, entry)
+        else:
+            # add it to the last timestep and to the previous ones without it
+            self._add_run(condition_name, max(seen, self._popped_row) + 1, last_row, entry)
+
+    def _add_run(self, condition_name, first, last, entry):
+        if condition_name not in self._columns:
+            self._columns[condition_name] = collections.deque()
+        self._columns[condition_name].append((first, last, self._seq, entry))
+        self._last_seen[condition_name] = last
+
+    def add_actions(self, executed_actions):
+        # the actions go to the last but one timestep, the previous timesteps without actions are removed
+        if len(self._alive) - self._first > 1 and len(self._actions[self._alive[-2]]) == 0:
+            self._actions[self._alive[-2]] = executed_actions
+            if len(executed_actions) > 0:
+                self._last_with_actions = self._alive[-2]
+            end = len(self._alive) - 2
+            start = end
+            while start > self._first and len(self._actions[self._alive[start - 1]]) == 0:
+                start -= 1
+            for row in self._alive[start:end]:
+                del self._actions[row]
+            del self._alive[start:end]
+
+    def _pop_lines(self, last_row):
+        # remove the timesteps up to last_row and return their lines
+        lines = []
+        while self._first < len(self._alive) and self._alive[self._first] <= last_row:
+            row = self._alive[self._first]
+            self._first += 1
+            states = []
+            for column in self._columns.values():
+                # the runs before this row are not needed anymore
+                while column and column[0][1] < row:
+                    column.popleft()
+                if column and column[0][0] <= row:
+                    states.append(column[0][2:])
+            states.sort()
+            actions = self._actions.pop(row)
+            self._popped_row = row
+            if len(states) < len(self.state_conditions) or len(actions) < len(self.action_conditions):
+                continue
+            lines.append("  ".join([entry for (seq, entry) in states]) + "\t" + "  ".join(actions) + "\n")
+        if self._first > 1024 and self._first * 2 > len(self._alive):
+            del self._alive[:self._first]
+            self._first = 0
+        return lines
+
+    def pop_final_lines(self):
+        last_row = self._last_with_actions
+        for condition_name in (self.state_conditions or self._last_seen.keys()):
+            last_row = min(last_row, self._last_seen.get(condition_name, -1))
+        return self._pop_lines(last_row)
+
+    def write(self, file):
+        for line in self._pop_lines(self._next_row):
+            file.write(line)
+
+
+class DemonstrationWriter(threading.Thread):
+    ''' File-like object writing to the file from a background thread,
+        flushed every flush_period seconds. A write error stops the thread
+        and closes the file, close() raises it. '''
+
+    def __init__(self, file, flush_period=1.0):
+        threading.Thread.__init__(self, name="pnp_demonstration_writer")
+        self.daemon = True
+        self._file = file
+        self._queue = queue.Queue()
+        self.flush_period = flush_period
+        self.error = None
+        self.start()
+
+    def write(self, text):
+        # after an error nothing is written anymore
+        if self.error is None:
+            self._queue.put(text)
+
+    def close(self):
+        # wait for the pending writes
+        self._queue.put(None)
+        self.join()
+        if self.error is not None:
+            raise self.error
+
+    def run(self):
+        last_flush = time.time()
+        try:
+            while True:
+                try:
+                    text = self._queue.get(timeout=self.flush_period)
+                except queue.Empty:
+                    text = ""
+                if text is None:
+                    break
+                self._file.write(text)
+                if time.time() - last_flush >= self.flush_period:
+                    self._file.flush()
+                    last_flush = time.time()
+        except (IOError, OSError) as e:
+            rospy.logerr("Error writing demonstration file %s: %s" % (getattr(self._file, "name", ""), e))
+            self.error = e
+        try:
+            self._file.close()
+        except (IOError, OSError) as e:
+            if self.error is None:
+                rospy.logerr("Error closing demonstration file %s: %s" % (getattr(self._file, "name", ""), e))
+                self.error = e
+
+
 class StateActionPairGenerator(ConditionListener):
 
-    def __init__(self, action_manager, condition_manager):
+    def __init__(self, action_manager, condition_manager, streaming=None):
         self._action_manager = action_manager
         self._condition_manager = condition_manager
 
-        self._actions_history = {}
-        self._states_history = {}
+        # write the timesteps to the file as soon as they are final, instead of at the stop
+        if streaming is None:
+            streaming = rospy.get_param("~stream_demonstrations", False)
+        self._streaming = streaming
+
+        self._recorders = {}
         self._saving_files = {}
         self._saving_bags = {}
-        self._request_info = {}
         self._files_lock = multiprocessing.Lock()
         self._bags_lock = multiprocessing.Lock()
 
@@ -27,6 +192,7 @@ class StateActionPairGenerator(ConditionListener):
         self._check_running_service_provider = rospy.Service("running_state_action_saver",
             PNPStopStateActionSaver, self._check_running_cb)
 
+        # the requested conditions are activated when a recording starts
         self._condition_manager.register_condition_listener(self)
 
     def _check_running_cb(self, req):
@@ -43,33 +209,49 @@ class StateActionPairGenerator(ConditionListener):
         save_bag = req.save_bag
         state_conditions = req.state_conditions
         action_conditions = req.action_conditions
-        print len(state_conditions), action_conditions
+        print(len(state_conditions), action_conditions)
 
         # Start saving the action-state pairs
         if not goal in self._saving_files.keys():
+            # Keep the requested conditions active while recording. The state
+            # conditions are added with their current value at the start, the
+            # missing ones are not recorded (they would block the timesteps)
+            recorded_conditions = []
+            for cond_name in state_conditions:
+                self._condition_manager.pin(cond_name)
+                if self._condition_manager.get_condition_instance(cond_name) is None:
+                    rospy.logwarn("State condition " + cond_name + " not found, it is not recorded")
+                    self._condition_manager.unpin(cond_name)
+                else:
+                    recorded_conditions.append(cond_name)
+            if len(state_conditions) > 0 and len(recorded_conditions) == 0:
+                rospy.logerr("No state condition found for " + goal)
+                return PNPStartStateActionSaverResponse(0)
+            state_conditions = recorded_conditions
+            if self._streaming and len(state_conditions) == 0:
+                rospy.logwarn("Streaming the demonstration of " + goal + " without state conditions: "
+                              "the conditions seen after a timestep is written are not added to it, "
+                              "the file may differ from the one written at the stop")
+            for cond_name in action_conditions:
+                self._condition_manager.pin(cond_name)
+
             if filepath == "":
                 # create new file
                 file_name = goal + "_" + str(rospy.Time.now().to_nsec()) + ".txt"
                 filepath = os.path.join(os.path.dirname(os.path.abspath(__file__)),\
                         "../demonstrations", file_name)
             file = open(filepath, "w")
+            if self._streaming:
+                file = DemonstrationWriter(file)
 
             # insert file in dict
-            self._saving_files.update({
-                goal : file
-            })
-            self._actions_history.update({
-                goal : []
-            })
-            self._states_history.update({
-                goal : []
-            })
-            self._request_info.update({
-                goal : {
-                    "state_conditions": state_conditions,
-                    "action_conditions": action_conditions
-                }
-            })
+            with self._files_lock:
+                self._saving_files.update({
+                    goal : file
+                })
+                self._recorders.update({
+                    goal : DemonstrationRecorder(state_conditions, action_conditions)
+                })
 
             rospy.loginfo("Started recording demonstration in " + filepath)
 
@@ -97,9 +279,8 @@ class StateActionPairGenerator(ConditionListener):
                 rospy.logwarn("Bag saver for " + goal + " already running")
                 return PNPStartStateActionSaverResponse(0)
 
-
         # Get the current condition state
-        current_state = self._condition_manager._condition_instances.values()
+        current_state = list(self._condition_manager._condition_instances.values())
         for condition_instance in current_state:
             if "get_name" in dir(condition_instance): # only topic conditions have this
                 self.receive_update(condition_instance)
@@ -110,34 +291,29 @@ class StateActionPairGenerator(ConditionListener):
 
         # Stop the state-action pair saver
         if goal in self._saving_files.keys():
-            # Save state actions in all open files
-            file = self._saving_files[goal]
-            for timestep in range(len(self._states_history[goal])):
-                if len(self._states_history[goal][timestep]) < len(self._request_info[goal]["state_conditions"]) or \
-            len(self._actions_history[goal][timestep]) < len(self._request_info[goal]["action_conditions"]):
-                    continue
-                for i, state_el in enumerate(self._states_history[goal][timestep]):
-                    if i>0:
-                        file.write("  ")
-                    file.write(state_el)
-                file.write("\t")
-                for i, ex_action in enumerate(self._actions_history[goal][timestep]):
-                    if i>0:
-                        file.write("  ")
-                    file.write(ex_action)
-                file.write("\n")
-
-            # close the file
+            # remove the recorder from the dict, no more updates are recorded
             with self._files_lock:
-                self._saving_files[goal].close()
-
-                # remove the file from the dict
-                del self._saving_files[goal]
-                del self._states_history[goal]
-                del self._actions_history[goal]
-                del self._request_info[goal]
-
+                file = self._saving_files.pop(goal)
+                recorder = self._recorders.pop(goal)
+
+            for cond_name in recorder.state_conditions + recorder.action_conditions:
+                self._condition_manager.unpin(cond_name)
+
+            # Save state actions in the file and close it (a streaming
+            # writer raises here the error that stopped it)
+            saved = True
+            try:
+                recorder.write(file)
+                file.close()
                 rospy.loginfo("Closed file " + goal)
+            except (IOError, OSError) as e:
+                rospy.logerr("Error saving the demonstration of " + goal + ": " + str(e))
+                saved = False
+                if not isinstance(file, DemonstrationWriter):
+                    try:
+                        file.close()
+                    except (IOError, OSError):
+                        pass
         else:
             rospy.logwarn("No running saver in file " + goal + " found")
             return PNPStopStateActionSaverResponse(0)
@@ -151,45 +327,23 @@ class StateActionPairGenerator(ConditionListener):
         else:
             rospy.logwarn("No running bag saver for " + goal + " found")
 
-        return PNPStopStateActionSaverResponse(1)
+        return PNPStopStateActionSaverResponse(1 if saved else 0)
 
     def receive_update(self, condition_instance):
         condition_name = condition_instance.get_name()
-        condition_value = condition_instance.get_value()
+        condition_value = str(condition_instance.get_value())
+        condition_entry = condition_name + "_".join(["", condition_value])
 
         # Save in state-action pairs file
         with self._files_lock:
-            for goal_id in self._saving_files.keys():
-                # Get the current condition state
-                current_state = self._condition_manager.get_conditions_dump()
-
-                # take the requested state conditions
-                state_conds = self._request_info[goal_id]["state_conditions"]
-                # take the requested action conditions
-                action_conds = self._request_info[goal_id]["action_conditions"]
-
+            for (goal_id, recorder) in self._recorders.items():
                 action_candidates = []
                 # consider this condition if is in the list or if the list is empty (all the conditions)
-                if condition_name in state_conds or len(state_conds) == 0:
-                    # if the condition was updated in the last timestep, here we create a new timestep
-                    if len(self._states_history[goal_id]) == 0 or condition_name in [cond.split("_")[0] for cond in self._states_history[goal_id][-1]]:
-                        # Save the condition
-                        self._states_history[goal_id].append([condition_name + "_".join(["", condition_value])])
-
-                        # Add empty container of actions for the current step
-                        self._actions_history[goal_id].append([])
-                    else:
-                        # Save the condition
-                        self._states_history[goal_id][-1].append(condition_name + "_".join(["", condition_value]))
-                        # ...and propagate in the previous states if not present
-                        for timestep in range(len(self._states_history[goal_id])-2, -1, -1):
-                            if not condition_name in [cond.split("_")[0] for cond in self._states_history[goal_id][timestep]]:
-                                self._states_history[goal_id][timestep].append(condition_name + "_".join(["", condition_value]))
-                            else:
-                                break
+                if recorder.is_state_condition(condition_name):
+                    recorder.add_state(condition_name, condition_entry)
 
                     # if we don't specify which conditions represents our action we try to infer them when the state changes
-                    if len(action_conds) == 0:
+                    if len(recorder.action_conditions) == 0:
                         # Get executable actions
                         action_list = self._action_manager.get_actions()
 
@@ -202,30 +356,25 @@ class StateActionPairGenerator(ConditionListener):
 
                 # TODO make it working with multiple action conditions
                 # save the condition in the action list
-                if condition_name in action_conds:
-                    action_candidates.append(condition_name + "_".join(["", condition_value]))
+                if condition_name in recorder.action_conditions:
+                    action_candidates.append(condition_entry)
 
                 # insert the action at the last state received, remove the previous timesteps without actions
-                executed_actions = action_candidates[:]
-                if len(self._actions_history[goal_id]) > 1 and len(self._actions_history[goal_id][-2]) == 0:
-                    self._actions_history[goal_id][-2] = executed_actions
-                    print self._states_history
-                    print self._actions_history
-                    for timestep in range(len(self._actions_history[goal_id])-3, -1, -1):
-                        if len(self._actions_history[goal_id][timestep]) == 0:
-                            del self._actions_history[goal_id][timestep]
-                            del self._states_history[goal_id][timestep]
-                        else:
-                            break
+                recorder.add_actions(action_candidates[:])
+
+                if self._streaming:
+                    lines = recorder.pop_final_lines()
+                    if lines:
+                        self._saving_files[goal_id].write("".join(lines))
 
         # Save in the bag
         instances = []
         instances.append(condition_instance)
-        instances.append(self._condition_manager._condition_instances["CurrentGoal"])
-        instances.append(self._condition_manager._condition_instances["CurrentNavigationGoal"])
-        instances.append(self._condition_manager._condition_instances["ClosestNode"])
-        instances.append(self._condition_manager._condition_instances["CurrentNode"])
+        for cond_name in ["CurrentGoal", "CurrentNavigationGoal", "ClosestNode", "CurrentNode"]:
+            instances.append(self._condition_manager.get_condition_instance(cond_name))
         for instance in instances:
+            if instance is None:
+                continue
             topic_message = instance.get_data() # the actual topic message
             topic_name = instance._topic_name # the type of topic message
             with self._bags_lock:
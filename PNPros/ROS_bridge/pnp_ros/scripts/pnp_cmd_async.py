@@ -0,0 +1,227 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# asyncio version of the ROS action_cmd.
+# Many plans can run concurrently on the same event loop, e.g.
+#
+#   async def main():
+#       p = AsyncPNPCmd()
+#       await p.begin()
+#       await asyncio.gather(p.exec_action('goto', 'kitchen', 'timeout_30', 'skip_action'),
+#                            p.exec_action('say', 'hello'))
+#       await p.end()
+
+import asyncio
+import time
+import rospy
+import std_msgs.msg
+
+import pnp_cmd_ros
+from pnp_cmd_ros import *
+
+
+class AsyncPNPCmd(PNPCmd):
+
+    # period of the evaluation of the ER conditions (timeouts use timers)
+    CONDITION_CHECK_PERIOD = 0.1
+
+    def __init__(self, debug_quiet=False, condition_cache_ttl=0.0):
+        PNPCmd.__init__(self, debug_quiet, condition_cache_ttl)
+        self._loop = None
+        self._status_waiters = {}  # action -> list of futures waiting for a status change
+        self._current_actions = {}
+
+    async def begin(self, node_name=None):
+        self._loop = asyncio.get_running_loop()
+
+        # several plans can share the same node
+        if not rospy.core.is_initialized():
+            if node_name is None:
+                node_name = 'plan_'
+            rospy.init_node(node_name, anonymous=True)
+
+        key = TOPIC_PNPACTIONCMD
+        self.pub_actioncmd = rospy.Publisher(key, std_msgs.msg.String, queue_size=10)
+        print("Publisher %s" %key)
+
+        key = TOPIC_PLANTOEXEC
+        self.pub_plantoexec = rospy.Publisher(key, std_msgs.msg.String, queue_size=10)
+        print("Publisher %s" %key)
+
+        key = get_robot_key(TOPIC_PNPACTIONSTATUS)
+        rospy.Subscriber(key, std_msgs.msg.String, self._action_status_cb)
+        print("Subscriber %s" %key)
+
+        key = SRV_PNPCONDITIONEVAL
+        print("Waiting for service %s ..." %key)
+        await self._loop.run_in_executor(None, rospy.wait_for_service, key)
+        print("Service %s OK" %key)
+
+        # wait for connections on action_cmd topic
+        while self.pub_actioncmd.get_num_connections() == 0:
+            await asyncio.sleep(0.5)
+        rospy.loginfo('Connections: %d', self.pub_actioncmd.get_num_connections())
+
+    async def end(self):
+        rospy.loginfo("Plan is ended")
+        for action in list(self._current_actions.keys()):
+            rospy.logwarn("Terminating action " + action)
+            self.action_cmd(action, self._current_actions[action]["params"], "stop")
+
+    ## bridge between the rospy threads and the event loop
+
+    def _action_status_cb(self, data):
+        PNPCmd._action_status_cb(self, data)
+        [action, status] = parse_action_status(data.data)
+        self._loop.call_soon_threadsafe(self._notify_status, action)
+
+    def _notify_status(self, action):
+        for fut in self._status_waiters.pop(action, []):
+            if not fut.done():
+                fut.set_result(None)
+
+    def set_action_status(self, action, status):
+        # called by action_cmd in the event loop: only the mirror is updated
+        # here, the parameter is written by _start_run before the command is
+        # sent, so that it cannot overwrite the status set by the action server
+        self._store_action_status(action, status)
+        self._notify_status(action)
+        return ''
+
+    def action_status(self, action):
+        with self._action_status_cv:
+            return self._action_status.get(action, '')
+
+    async def wait_action_status(self, action, status, timeout=None):
+        # same as PNPCmd.wait_action_status: woken up by the status topic and
+        # synced with the parameter server if no status arrives for a while
+        deadline = None if timeout is None else self._loop.time() + timeout
+        while True:
+            r = self.action_status(action)
+            if r != status:
+                return r
+            with self._action_status_cv:
+                last_update = self._action_status_time.get(action, 0)
+            wait_time = last_update + self.ACTION_STATUS_RESYNC_PERIOD - time.time()
+            if deadline is not None:
+                remaining = deadline - self._loop.time()
+                if remaining <= 0:
+                    return r
+                wait_time = min(wait_time, remaining)
+            if wait_time <= 0:
+                await self._loop.run_in_executor(None, self._resync_action_status, action)
+                continue
+            fut = self._loop.create_future()
+            waiters = self._status_waiters.setdefault(action, [])
+            waiters.append(fut)
+            try:
+                await asyncio.wait_for(fut, wait_time)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                # the futures of the timed out waits do not pile up
+                if fut in waiters:
+                    waiters.remove(fut)
+                if not waiters and self._status_waiters.get(action) is waiters:
+                    del self._status_waiters[action]
+
+    ## plan execution
+
+    async def execRecovery(self, recovery):
+        if not isinstance(recovery, RecoveryProcedure):
+            recovery = RecoveryProcedure(recovery)
+        for (ap, action, params) in recovery.steps:
+            self.printindent()
+            print("%s-- recovery %s%s" % (tcol.WARNING, ap, tcol.ENDC))
+            if action is None:
+                return ap
+            await self.exec_action(action, params)
+
+    async def _check_interrupt_conditions(self, action):
+        ers = self._action_ers.get(action)
+        if ers is None:
+            return False, ""
+
+        if not ers.armed:
+            self._arm_ERs(action)
+
+        rule = ers.expired_timeout(time.time())
+        if rule is None and ers.conditions:
+            truth_values = await self.get_conditions(ers.condition_literals)
+            for condition_rule, value in zip(ers.conditions, truth_values):
+                if value:
+                    rule = condition_rule
+                    break
+
+        if rule is not None:
+            return True, rule.recovery
+        return False, ""
+
+    def _next_check(self, action):
+        # time to wait before the next check of the ERs: the conditions are
+        # sampled, the timeouts fire exactly at their deadline
+        ers = self._action_ers.get(action)
+        if ers is None:
+            return None
+        wait = self.CONDITION_CHECK_PERIOD if ers.conditions else None
+        deadline = ers.next_deadline()
+        if deadline is not None:
+            to_deadline = max(0.0, deadline - time.time()) + 0.001
+            wait = to_deadline if wait is None else min(wait, to_deadline)
+        return wait
+
+    async def _start_run(self, action, params):
+        # write the status parameter before sending the start command
+        await self._loop.run_in_executor(None, self._set_action_status_param, action, ACTION_STARTED)
+        PNPCmd._start_run(self, action, params)
+
+    async def exec_action(self, action, params, interrupt="", recovery=""):
+        # same steps of PNPCmd_Base.exec_action, waiting on the event loop
+        if not self._prepare_exec(action, params, interrupt, recovery):
+            return None
+
+        run = True
+        while run:  # interrupt may restart this action
+
+            await self._start_run(action, params)
+
+            r = await self.wait_action_status(action, "started")
+
+            # wait for action to terminate or for an interrupt
+            c = False
+            rec = ""
+            while r == "running" and not c:
+                r = await self.wait_action_status(action, "running", timeout=self._next_check(action))
+                c, rec = await self._check_interrupt_conditions(action)
+
+            r, interrupted = self._end_run(action, params, r, c, False)
+            run = False  # exit
+            if interrupted:
+                await self.wait_action_status(action, "running")
+                self.execlevel += 1
+                p_rec = await self.execRecovery(rec)
+                self.execlevel -= 1
+                run = self._restart_after_recovery(p_rec)
+                if p_rec == "fail_plan":
+                    await self.end()
+        return r
+
+    def start_action(self, action, params, interrupt="", recovery=""):
+        """Schedule exec_action on the event loop and return its task"""
+        return self._loop.create_task(self.exec_action(action, params, interrupt, recovery))
+
+    async def get_condition(self, cond):
+        # the service call is blocking, run it outside the event loop
+        return await self._loop.run_in_executor(None, PNPCmd.get_condition, self, cond)
+
+    async def get_conditions(self, conds):
+        return await self._loop.run_in_executor(None, PNPCmd.get_conditions, self, conds)
+
+    async def plan_cmd(self, planname, cmd):
+        if (cmd=='start'):
+            await self._loop.run_in_executor(None, self.plan_gen, planname)
+            self.pub_plantoexec.publish(planname)
+        elif (cmd=='stop'):
+            self.pub_plantoexec.publish('stop')
+        else:
+            print("ERROR: plan cmd %s %s undefined!" %(planname,cmd))
@@ -7,6 +7,10 @@ import argparse
 import sys
 import os
 import time
+import heapq
+import threading
+import concurrent.futures
+import functools
 import yaml
 
 
@@ -24,64 +28,28 @@ class tcol:
 debug_actions_path = "../lcastor_actions/debug_config.yaml"
 
 
-class PNPCmd_Base(object):
-
-    def __init__(self):
-        self.execlevel = 0  # pretty print
-
-        # to store Execution Rules
-        self._action_ers = {}
-
-    def action_cmd_base(self, action, params, cmd):
-        self.printindent()
-        if cmd == "start":
-            print("  %s%s %s -> %s%s" % (tcol.OKGREEN, action, params, cmd, tcol.ENDC))
-        elif cmd == "interrupt":
-            print("  %s%s %s -> %s%s" % (tcol.WARNING, action, params, cmd, tcol.ENDC))
-        elif cmd == "end" or cmd == "success":
-            print("  %s%s %s -> %s%s" % (tcol.OKGREEN, action, params, cmd, tcol.ENDC))
-        elif cmd == "failure":
-            print("  %s%s %s -> %s%s" % (tcol.FAIL, action, params, cmd, tcol.ENDC))
-        else:
-            print("  %s %s -> %s" % (action, params, cmd))
-        self.action_cmd(action, params, cmd)
-
-    def action_params_split(self, astr):
-        astr = astr.strip()
-        c = astr.find("_")
-        if c < 0:
-            action = astr
-            params = ""
-        else:
-            action = astr[0:c]
-            params = astr[c + 1 :]
-        return [action, params]
-
-    def execRecovery(self, recovery):
-        if recovery == "":
-            return
-        v = recovery.split(";")
-        for i in range(len(v)):
-            ap = v[i].strip()
-            self.printindent()
-            print("%s-- recovery %s%s" % (tcol.WARNING, ap, tcol.ENDC))
-            if ap == "restart_action":
-                return ap
-            elif ap == "skip_action":
-                return ap
-            elif ap == "restart_plan":
-                return ap
-            elif ap == "fail_plan":
-                return ap
-            else:
-                [action, params] = self.action_params_split(ap)
-                self.exec_action(action, params)
-
-    def printindent(self):
-        for i in range(self.execlevel):
-            print("    ", end="")
-
-    def get_debug_actions(self, debug_config_path):
+class DebugPolicy(object):
+    """Debug configuration read from a yaml file.
+
+    The file is parsed once and reloaded only when its mtime changes, the
+    enabled/disabled actions are kept in a set for constant time lookups.
+    The policy is shared by the concurrent actions: each check refreshes
+    and reads it once under a lock.
+    """
+
+    def __init__(self, path, quiet=False):
+        self.path = path
+        self.quiet = quiet  # skip the per-call [DEBUG] prints
+        self._mtime = None
+        self._loaded = False
+        self.config = None
+        self.mode = None
+        self.type = None
+        self.actions = frozenset()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def read_config(debug_config_path):
         if not os.path.exists(debug_config_path):
             print("%s[DEBUG] file was not found.%s" % (tcol.OKBLUE, tcol.ENDC))
             print(
@@ -134,145 +102,426 @@ class PNPCmd_Base(object):
             "value": {},
         }
 
-    def is_debug_action(self, action):
-        debug_actions = self.get_debug_actions(debug_actions_path)
-        if debug_actions["Debug"] is False:
+    def _refresh(self):
+        # call it holding _lock
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            mtime = None
+        if self._loaded and mtime == self._mtime:
+            return
+        self._mtime = mtime
+        self._loaded = True
+        self.config = self.read_config(self.path)
+        if self.config["Debug"]:
+            self.mode = self.config["value"]["mode"]
+            self.type = self.config["value"]["type"]
+            self.actions = frozenset(self.config["value"]["actions"])
+        else:
+            self.mode = None
+            self.type = None
+            self.actions = frozenset()
+
+    def status(self, action):
+        """Debug status of the action (type, mode, perform_action), None if not in debug mode"""
+        with self._lock:
+            self._refresh()
+            mode, debug_type, actions = self.mode, self.type, self.actions
+        if debug_type == "enable":
+            perform_action = action in actions
+        elif debug_type == "disable":
+            perform_action = action not in actions
+        else:
             return None
+        return {"type": debug_type, "mode": mode, "perform_action": perform_action}
+
+    def perform_action(self, action):
+        """True/False if the debug mode enables/disables the action, None if not in debug mode"""
+        status = self.status(action)
+        return status["perform_action"] if status is not None else None
+
+    def log(self, msg):
+        if not self.quiet:
+            print("%s[DEBUG] %s%s" % (tcol.OKBLUE, msg, tcol.ENDC))
+
+
+RECOVERY_DIRECTIVES = ("restart_action", "skip_action", "restart_plan", "fail_plan")
+
+
+def split_action_params(astr):
+    astr = astr.strip()
+    c = astr.find("_")
+    if c < 0:
+        return [astr, ""]
+    return [astr[0:c], astr[c + 1 :]]
+
+
+class RecoveryProcedure(object):
+    """Recovery string of an ER, tokenized once in a list of steps.
+
+    Each step is a tuple (text, action, params) where action is None for the
+    directives that terminate the recovery (restart_action, skip_action, ...).
+    """
+
+    def __init__(self, recovery):
+        self.text = recovery
+        self.steps = []
+        if recovery == "":
+            return
+        for ap in recovery.split(";"):
+            ap = ap.strip()
+            if ap in RECOVERY_DIRECTIVES:
+                self.steps.append((ap, None, None))
+            else:
+                [action, params] = split_action_params(ap)
+                self.steps.append((ap, action, params))
+
+    def __str__(self):
+        return self.text
+
 
-        mode = debug_actions["value"]["mode"]
-        # msg = debug_actions["msg"] # TODO: setting up some verbose mode
-        type = debug_actions["value"]["type"]
-        actions = debug_actions["value"]["actions"]
+class ExecutionRule(object):
+    """Interrupt condition of an action with its compiled recovery"""
 
-        if type == "enable":
-            if action in actions:
-                return {"type": type, "mode": mode, "perform_action": True}
-            return {"type": type, "mode": mode, "perform_action": False}
+    def __init__(self, interrupt, recovery):
+        self.interrupt = interrupt
+        self.recovery = RecoveryProcedure(recovery)
 
-        if type == "disable":
-            if action not in actions:
-                return {"type": type, "mode": mode, "perform_action": True}
-            return {"type": type, "mode": mode, "perform_action": False}
 
-        print("%s%s%s" % (tcol.OKBLUE, "Debug mode check in exec_action", tcol.ENDC))
+class TimeoutRule(ExecutionRule):
+    """timeout_<seconds> interrupt, fired when the action runs for more than timeout seconds"""
+
+    def __init__(self, interrupt, recovery):
+        ExecutionRule.__init__(self, interrupt, recovery)
+        self.timeout = float(interrupt.split("_")[1])
+
+
+class ConditionRule(ExecutionRule):
+    """Interrupt given by a condition, evaluator is bound to the condition literal"""
+
+    def __init__(self, interrupt, recovery, get_condition):
+        ExecutionRule.__init__(self, interrupt, recovery)
+        self.evaluate = functools.partial(get_condition, interrupt)
+
+
+class ActionERs(object):
+    """Compiled execution rules of an action.
+
+    Timeout rules are armed as absolute deadlines in a heap when the action
+    starts, so checking them costs O(1) at each tick.
+    """
+
+    def __init__(self):
+        self.rules = {}  # interrupt -> rule
+        self.timeouts = []
+        self.conditions = []
+        self.condition_literals = []
+        self._deadlines = []
+        self.armed = False
+
+    def add(self, rule):
+        self.rules[rule.interrupt] = rule
+        self.timeouts = [r for r in self.rules.values() if isinstance(r, TimeoutRule)]
+        self.conditions = [r for r in self.rules.values() if isinstance(r, ConditionRule)]
+        self.condition_literals = [r.interrupt for r in self.conditions]
+        self.armed = False
+
+    def arm(self, starttime):
+        self._deadlines = [(starttime + r.timeout, i, r) for i, r in enumerate(self.timeouts)]
+        heapq.heapify(self._deadlines)
+        self.armed = True
+
+    def next_deadline(self):
+        if self._deadlines:
+            return self._deadlines[0][0]
         return None
 
-    def check_action_is_debug_disabled(self, action) -> bool:
-        debug_status = self.is_debug_action(action)
-        print("%s[DEBUG] status: %s%s" % (tcol.OKBLUE, debug_status, tcol.ENDC))
-        if debug_status is not None:
-            if debug_status["perform_action"] is False:
-                print(
-                    "%s[DEBUG] mode (%s): action %s is disabled%s"
-                    % (tcol.OKBLUE, debug_status["mode"], action, tcol.ENDC)
-                )
-                return True
-            if debug_status["perform_action"] is True:
-                print(
-                    "%s[DEBUG] mode (%s): action %s is enabled%s"
-                    % (tcol.OKBLUE, debug_status["mode"], action, tcol.ENDC)
-                )
-                return False
-        return False
+    def expired_timeout(self, now):
+        if self._deadlines and now > self._deadlines[0][0]:
+            return self._deadlines[0][2]
+        return None
+
+
+ACTION_POOL_SIZE = 16  # max number of actions started with start_action running together
+
+ACTION_DEBUG_DISABLED = "debug_disabled"  # status of the actions prevented by the debug mode
+
+_action_pool = None
+_action_pool_lock = threading.Lock()
+
+
+def get_action_pool():
+    """Worker pool shared by all the actions started with start_action"""
+    global _action_pool
+    with _action_pool_lock:
+        if _action_pool is None:
+            _action_pool = concurrent.futures.ThreadPoolExecutor(
+                max_workers=ACTION_POOL_SIZE, thread_name_prefix="pnp_action")
+    return _action_pool
+
 
-    def exec_action(self, action, params, interrupt="", recovery=""):
+class ActionHandle(object):
+    """Handle of an action started with PNPCmd_Base.start_action.
+
+    The action runs with the same interrupt/recovery semantics of
+    exec_action; wait() returns the final status of the action
+    (ACTION_DEBUG_DISABLED if the debug mode prevented it).
+    """
+
+    def __init__(self, action, params):
+        self.action = action
+        self.params = params
+        self.future = None
+        self._cancel_event = threading.Event()
+
+    def wait(self, timeout=None):
+        """Final status of the action, None if it is not terminated within timeout seconds"""
+        try:
+            r = self.future.result(timeout)
+            # exec_action returns None only if the debug mode prevents the action
+            return r if r is not None else ACTION_DEBUG_DISABLED
+        except concurrent.futures.TimeoutError:
+            return None
+        except concurrent.futures.CancelledError:
+            return "interrupt"
+
+    def done(self):
+        return self.future.done()
+
+    def cancel(self):
+        """Interrupt the action (no recovery is executed)"""
+        self._cancel_event.set()
+        self.future.cancel()  # if not started yet
+
+    def cancelled(self):
+        return self._cancel_event.is_set()
+
+
+class PNPCmd_Base(object):
+
+    def __init__(self, debug_quiet=False):
+        self.execlevel = 0  # pretty print
+
+        # to store Execution Rules
+        self._action_ers = {}
+
+        # debug configuration (reloaded only when the file changes)
+        self.debug_policy = DebugPolicy(debug_actions_path, quiet=debug_quiet)
+
+    def action_cmd_base(self, action, params, cmd):
         self.printindent()
-        print("%sExec: %s %s %s" % (tcol.OKGREEN, action, params, tcol.ENDC))
+        if cmd == "start":
+            print("  %s%s %s -> %s%s" % (tcol.OKGREEN, action, params, cmd, tcol.ENDC))
+        elif cmd == "interrupt":
+            print("  %s%s %s -> %s%s" % (tcol.WARNING, action, params, cmd, tcol.ENDC))
+        elif cmd == "end" or cmd == "success":
+            print("  %s%s %s -> %s%s" % (tcol.OKGREEN, action, params, cmd, tcol.ENDC))
+        elif cmd == "failure":
+            print("  %s%s %s -> %s%s" % (tcol.FAIL, action, params, cmd, tcol.ENDC))
+        else:
+            print("  %s %s -> %s" % (action, params, cmd))
+        self.action_cmd(action, params, cmd)
 
-        debug_mode = self.check_action_is_debug_disabled(action)
-        print(
-            "%s[DEBUG] mode check in exec_action %s%s"
-            % (tcol.OKBLUE, debug_mode, tcol.ENDC)
-        )
-        if debug_mode:
-            return print("%s[DEBUG] Preventing Action %s%s"
-            % (tcol.OKBLUE, action, tcol.ENDC))
+    def action_params_split(self, astr):
+        return split_action_params(astr)
+
+    def execRecovery(self, recovery, cancel_event=None):
+        if not isinstance(recovery, RecoveryProcedure):
+            recovery = RecoveryProcedure(recovery)
+        for (ap, action, params) in recovery.steps:
+            if cancel_event is not None and cancel_event.is_set():
+                return None
+            self.printindent()
+            print("%s-- recovery %s%s" % (tcol.WARNING, ap, tcol.ENDC))
+            if action is None:
+                return ap
+            self.exec_action(action, params, cancel_event=cancel_event)
 
-        run = True
+    def printindent(self):
+        for i in range(self.execlevel):
+            print("    ", end="")
 
-        # add the ER
-        if interrupt != "" and recovery != "":
-            self.add_ER(action, interrupt, recovery)
+    def get_debug_actions(self, debug_config_path):
+        return DebugPolicy.read_config(debug_config_path)
+
+    def is_debug_action(self, action):
+        return self.debug_policy.status(action)
+
+    def check_action_is_debug_disabled(self, action) -> bool:
+        debug_status = self.debug_policy.status(action)
+        if debug_status is None:
+            return False
+        perform_action = debug_status["perform_action"]
+        if self.debug_policy.quiet:
+            return not perform_action
+        self.debug_policy.log("status: %s" % debug_status)
+        self.debug_policy.log("mode (%s): action %s is %s"
+            % (debug_status["mode"], action, "enabled" if perform_action else "disabled"))
+        return not perform_action
+
+    def exec_action(self, action, params, interrupt="", recovery="", cancel_event=None):
+        if not self._prepare_exec(action, params, interrupt, recovery):
+            return None
 
+        run = True
         while run:  # interrupt may restart this action
 
-            self.action_cmd_base(action, params, "start")
+            self._start_run(action, params)
 
             # the PNP action server will change the status to running after it stated
             # the action. Therefore we wait here for that to happen.
-
-            while self.action_status(action) == "started":
-                time.sleep(0.1)
+            r = self._wait_action_started(action, cancel_event)
+            if r == "started":
+                # cancelled before the action server started it
+                r = "running"
 
             # wait for action to terminate
-            r = "running"
             c = False
-            while r == "running" and not c:
-                r = self.action_status(action)
+            rec = ""
+            while r == "running" and not c and not self._cancelled(cancel_event):
+                # returns as soon as the status changes, or after 0.1 s
+                r = self.wait_action_status(action, "running", timeout=0.1)
                 # check for interrupt condition
                 c, rec = self._check_interrupt_conditions(action)
 
-                time.sleep(0.1)
-            print("   -- action status: %s, interrupt condition: %r" % (r, c))
+            r, interrupted = self._end_run(action, params, r, c, self._cancelled(cancel_event))
             run = False  # exit
-            if not c:  # normal termination
-                self.printindent()
-                self.action_cmd_base(action, params, r)
-                # if (r=='success'):
-                #     print("  %s%s %s -> %s%s" %(tcol.OKGREEN,action,params,r,tcol.ENDC))
-                # else:
-                #     print("  %s%s %s -> %s%s" %(tcol.FAIL,action,params,r,tcol.ENDC))
-            else:  # interrupt
-                r = "interrupt"
-                self.action_cmd_base(action, params, r)
-                while self.action_status(action) == "running":
-                    time.sleep(0.1)
-                self.execlevel += 1
-                p_rec = self.execRecovery(rec)
-                self.execlevel -= 1
-                if p_rec == "restart_action":
-                    run = True
-                elif p_rec == "fail_plan":
-                    self.end()
-                else:
-                    print(
-                        "[ERROR] The recovery procedure "
-                        + p_rec
-                        + " may not be implemented. I am just stopping the current action and continuing with the plan."
-                    )
+            if interrupted:
+                self.wait_action_status(action, "running")
+                if not self._cancelled(cancel_event):
+                    self.execlevel += 1
+                    p_rec = self.execRecovery(rec, cancel_event)
+                    self.execlevel -= 1
+                    if not self._cancelled(cancel_event):
+                        run = self._restart_after_recovery(p_rec)
+                        if p_rec == "fail_plan":
+                            self.end()
         return r
 
+    ## steps of exec_action shared with the asyncio client
+
+    def _prepare_exec(self, action, params, interrupt, recovery):
+        # False if the debug mode disables the action
+        self.printindent()
+        print("%sExec: %s %s %s" % (tcol.OKGREEN, action, params, tcol.ENDC))
+
+        debug_mode = self.check_action_is_debug_disabled(action)
+        self.debug_policy.log("mode check in exec_action %s" % debug_mode)
+        if debug_mode:
+            self.debug_policy.log("Preventing Action %s" % action)
+            return False
+
+        # add the ER
+        if interrupt != "" and recovery != "":
+            self.add_ER(action, interrupt, recovery)
+        return True
+
+    def _start_run(self, action, params):
+        self.action_cmd_base(action, params, "start")
+        self._arm_ERs(action)
+
+    def _end_run(self, action, params, r, c, cancelled):
+        # send the command ending this run of the action, returns the final
+        # status and True if the action is interrupted (the caller waits for
+        # the end of its running status and, if not cancelled, runs the recovery)
+        print("   -- action status: %s, interrupt condition: %r" % (r, c))
+        if r != "running" and (cancelled or not c):
+            # normal termination (also if cancelled after it)
+            self.printindent()
+            self.action_cmd_base(action, params, r)
+            return r, False
+        # interrupt condition, or cancelled through the ActionHandle
+        r = "interrupt"
+        self.action_cmd_base(action, params, r)
+        return r, True
+
+    def _restart_after_recovery(self, p_rec):
+        # True if the recovery restarts the action
+        if p_rec == "restart_action":
+            return True
+        if p_rec != "fail_plan":
+            print(
+                "[ERROR] The recovery procedure "
+                + str(p_rec)
+                + " may not be implemented. I am just stopping the current action and continuing with the plan."
+            )
+        return False
+
+    @staticmethod
+    def _cancelled(cancel_event):
+        return cancel_event is not None and cancel_event.is_set()
+
+    def _wait_action_started(self, action, cancel_event=None):
+        # wait while the action is started, returns the new status ("started" if cancelled)
+        if cancel_event is None:
+            return self.wait_action_status(action, "started")
+        r = "started"
+        while r == "started" and not cancel_event.is_set():
+            r = self.wait_action_status(action, "started", timeout=0.1)
+        return r
+
+    def start_action(self, action, params, interrupt="", recovery=""):
+        """Non-blocking version of exec_action, returns an ActionHandle"""
+        handle = ActionHandle(action, params)
+        handle.future = get_action_pool().submit(
+            self.exec_action, action, params, interrupt, recovery, handle._cancel_event)
+        return handle
+
+    def wait_all(self, handles, timeout=None):
+        """Wait for all the actions (fork-join), returns the list of their final status"""
+        concurrent.futures.wait([h.future for h in handles], timeout)
+        return [h.wait(0) for h in handles]
+
+    def wait_any(self, handles, timeout=None):
+        """Wait for the first action that terminates and return its handle (None on timeout)"""
+        done, _ = concurrent.futures.wait([h.future for h in handles], timeout,
+                                          return_when=concurrent.futures.FIRST_COMPLETED)
+        for h in handles:
+            if h.future in done:
+                return h
+        return None
+
+    def _arm_ERs(self, action):
+        # timeouts are counted from the start of the action
+        if action in self._action_ers:
+            st = self.action_starttime(action)
+            if st is None:
+                st = time.time()
+            self._action_ers[action].arm(st)
+
     def _check_interrupt_conditions(self, action):
-        c = False
-        rec = ""
-
-        if action in self._action_ers.keys():
-            # print self._action_ers[action].items()
-            for interrupt, recovery in self._action_ers[action].items():
-                if interrupt[0:7].lower() == "timeout":
-                    now = time.time()
-                    st = self.action_starttime(action)
-                    v = interrupt.split("_")
-                    # print 'timeout %f %f diff: %f > %f' %(now, st, now-st, float(v[1]) )
-                    c = (now - st) > float(v[1])
-                else:
-                    c = self.get_condition(interrupt)
-                # if the condition is true add the recovery to execute
-                if c:
-                    rec = recovery
-                    return c, rec
-
-        # else:
-        # print "No ers for action ", action
-        return c, rec
+        ers = self._action_ers.get(action)
+        if ers is None:
+            return False, ""
+
+        if not ers.armed:
+            self._arm_ERs(action)
+
+        rule = ers.expired_timeout(time.time())
+        if rule is None and ers.conditions:
+            # all the condition rules are evaluated with a single request
+            truth_values = self.get_conditions(ers.condition_literals)
+            for condition_rule, value in zip(ers.conditions, truth_values):
+                if value:
+                    rule = condition_rule
+                    break
+
+        # if the condition is true return the recovery to execute
+        if rule is not None:
+            return True, rule.recovery
+        return False, ""
 
     def add_ER(self, action, interrupt, recovery):
         # add the action if not already there
-        if action not in self._action_ers.keys():
-            self._action_ers[action] = {}
+        if action not in self._action_ers:
+            self._action_ers[action] = ActionERs()
 
-        # add the interrupt recovery pair associate with the action
-        self._action_ers[action][interrupt] = recovery
+        # compile the interrupt recovery pair associated with the action
+        if interrupt[0:7].lower() == "timeout":
+            rule = TimeoutRule(interrupt, recovery)
+        else:
+            rule = ConditionRule(interrupt, recovery, self.get_condition)
+        self._action_ers[action].add(rule)
 
     def plan_gen(self, planname):
         oscmd = "cd %s; ./genplan.sh %s.plan %s.er" % (
@@ -298,9 +547,26 @@ class PNPCmd_Base(object):
     def action_status(self, action):
         return ""
 
+    def action_starttime(self, action):
+        return None
+
+    def wait_action_status(self, action, status, timeout=None):
+        # wait while the action is in the given status and return the new one
+        # (or the same status if the timeout expires). This is a polling
+        # implementation, subclasses receiving status events should override it.
+        start = time.time()
+        r = self.action_status(action)
+        while r == status and (timeout is None or time.time() - start < timeout):
+            time.sleep(0.1)
+            r = self.action_status(action)
+        return r
+
     def get_condition(self, cond):
         return False
 
+    def get_conditions(self, conds):
+        return [self.get_condition(cond) for cond in conds]
+
     def set_condition(self, cond, value):
         return
 
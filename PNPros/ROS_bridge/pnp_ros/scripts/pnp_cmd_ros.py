@@ -6,6 +6,7 @@ import sys
 import os
 import roslib, rospy
 import time
+import threading
 import string
 import random
 import pnp_msgs.msg, pnp_msgs.srv
@@ -26,6 +27,8 @@ from pnp_cmd_base import *
 import pnp_common
 from pnp_common import *
 
+from pnp_condition_client import ConditionClient
+
 roslib.load_manifest('pnp_ros')
 PKG = 'pnp_ros'
 NODE = 'pnp_cmd'
@@ -33,11 +36,24 @@ NODE = 'pnp_cmd'
 # ROS names (see pnp_ros/include/pnp_ros/names.h)
 class PNPCmd(PNPCmd_Base):
 
-    def __init__(self):
-        PNPCmd_Base.__init__(self)
+    # the action status is read from the parameter server if no status
+    # message is received for this time (seconds)
+    ACTION_STATUS_RESYNC_PERIOD = 1.0
+
+    def __init__(self, debug_quiet=False, condition_cache_ttl=0.0):
+        PNPCmd_Base.__init__(self, debug_quiet)
         self.pub_actioncmd = None
         self.pub_plantoexec = None
 
+        # persistent connections to the condition services (created after init_node)
+        self.condition_cache_ttl = condition_cache_ttl
+        self._condition_client = None
+
+        # local mirror of the action status, updated by the status topic
+        self._action_status = {}
+        self._action_status_time = {}  # time of the last status received for each action
+        self._action_status_cv = threading.Condition()
+
     def init(self):
         parser = argparse.ArgumentParser()
         parser.add_argument("-a", type=str, default="",
@@ -75,6 +91,10 @@ class PNPCmd(PNPCmd_Base):
         print("Publisher %s" %key)
         self.rate.sleep()
 
+        key = get_robot_key(TOPIC_PNPACTIONSTATUS)
+        rospy.Subscriber(key, std_msgs.msg.String, self._action_status_cb)
+        print("Subscriber %s" %key)
+
         key = SRV_PNPCONDITIONEVAL #get_robot_key(SRV_PNPCONDITIONEVAL)
         print("Waiting for service %s ..." %key)
         rospy.wait_for_service(key)
@@ -110,13 +130,9 @@ class PNPCmd(PNPCmd_Base):
 
     def action_cmd(self,action,params,cmd):
         debug_mode = self.check_action_is_debug_disabled(action)
-        print(
-            "%s[DEBUG] mode check in action_cmd %s%s"
-            % (tcol.OKBLUE, debug_mode, tcol.ENDC)
-        )
+        self.debug_policy.log("mode check in action_cmd %s" % debug_mode)
         if debug_mode:
-            return print("%s[DEBUG] Preventing Action %s%s"
-            % (tcol.OKBLUE, action, tcol.ENDC))
+            return self.debug_policy.log("Preventing Action %s" % action)
 
         if (cmd=='stop' or cmd=='interrupt'):
             cmd = 'interrupt'
@@ -150,7 +166,17 @@ class PNPCmd(PNPCmd_Base):
         self.pub_actioncmd.publish(data)
         # time.sleep(0.5)
 
+    def _store_action_status(self, action, status):
+        with self._action_status_cv:
+            self._action_status[action] = status
+            self._action_status_time[action] = time.time()
+            self._action_status_cv.notify_all()
+
     def set_action_status(self, action, status):
+        self._store_action_status(action, status)
+        return self._set_action_status_param(action, status)
+
+    def _set_action_status_param(self, action, status):
         key = get_robot_key(PARAM_PNPACTIONSTATUS)+action
         try:
             r = rospy.set_param(key, status)
@@ -161,7 +187,11 @@ class PNPCmd(PNPCmd_Base):
             r = ''
         return r
 
-    def action_status(self, action):
+    def _action_status_cb(self, data):
+        [action, status] = parse_action_status(data.data)
+        self._store_action_status(action, status)
+
+    def _action_status_param(self, action):
         key = get_robot_key(PARAM_PNPACTIONSTATUS)+action
         try:
             r = rospy.get_param(key)
@@ -172,6 +202,54 @@ class PNPCmd(PNPCmd_Base):
             r = ''
         return r
 
+    def action_status(self, action):
+        with self._action_status_cv:
+            if action in self._action_status:
+                return self._action_status[action]
+        # no event received yet for this action
+        r = self._action_status_param(action)
+        with self._action_status_cv:
+            if action not in self._action_status:
+                self._action_status[action] = r
+                self._action_status_time[action] = time.time()
+            return self._action_status[action]
+
+    def _resync_action_status(self, action):
+        # read the parameter server without holding the lock; a status received
+        # meanwhile is newer than the parameter and is kept
+        with self._action_status_cv:
+            last_update = self._action_status_time.get(action)
+        r = self._action_status_param(action)
+        with self._action_status_cv:
+            if self._action_status_time.get(action) == last_update:
+                self._action_status[action] = r
+                self._action_status_time[action] = time.time()
+                self._action_status_cv.notify_all()
+
+    def wait_action_status(self, action, status, timeout=None):
+        # the status topic wakes us up on every transition; if no status is
+        # received for the resync period (across the calls, e.g. exec_action
+        # polling with short timeouts) the mirror is synced with the parameter
+        # server, in case a message has been lost
+        resync_period = self.ACTION_STATUS_RESYNC_PERIOD
+        self.action_status(action)
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            with self._action_status_cv:
+                r = self._action_status.get(action, '')
+                if r != status:
+                    return r
+                now = time.time()
+                wait_time = self._action_status_time.get(action, 0) + resync_period - now
+                if deadline is not None:
+                    if now >= deadline:
+                        return r
+                    wait_time = min(wait_time, deadline - now)
+                if wait_time > 0:
+                    self._action_status_cv.wait(wait_time)
+                    continue
+            self._resync_action_status(action)
+
     def action_starttime(self, action):
         if action in self._current_actions.keys():
             return self._current_actions[action]["starttime"]
@@ -179,15 +257,31 @@ class PNPCmd(PNPCmd_Base):
             rospy.logwarn("Current action starttime not set.")
             return None
 
-    def get_condition(self, cond):
+    def condition_client(self):
+        if self._condition_client is None:
+            self._condition_client = ConditionClient(self.condition_cache_ttl)
+        return self._condition_client
+
+    def _evaluate_condition(self, cond):
         try:
-            service = rospy.ServiceProxy(get_robot_key(SRV_PNPCONDITIONEVAL), pnp_msgs.srv.PNPCondition)
-            r = service(cond)
-            return r.truth_value!=0
-        except rospy.ServiceException as e:
+            return self.condition_client().evaluate(cond)
+        except (rospy.ServiceException, rospy.ROSException) as e:
             print("Service call failed: %s"%e)
             return False
 
+    def get_condition(self, cond):
+        return self._evaluate_condition(cond)
+
+    def get_conditions(self, conds):
+        if len(conds) == 0:
+            return []
+        try:
+            return self.condition_client().evaluate_many(conds)
+        except (rospy.ServiceException, rospy.ROSException) as e:
+            print("Service call failed: %s"%e)
+            # the failing literals are False, the others are still evaluated
+            return [self._evaluate_condition(cond) for cond in conds]
+
     def plan_cmd(self, planname, cmd): # non-blocking
         if (cmd=='start'):
             self.plan_gen(planname)
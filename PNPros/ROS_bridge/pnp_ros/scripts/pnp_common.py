@@ -1,8 +1,13 @@
+import threading
 import rospy
+import std_msgs.msg
 
 TOPIC_PLANTOEXEC = "planToExec"
 TOPIC_PNPACTIONCMD = "PNPActionCmd"
+TOPIC_PNPACTIONSTATUS = "PNPActionStatus"
+TOPIC_CONDITIONUPDATE = "/condition_update"
 SRV_PNPCONDITIONEVAL = "PNPConditionEval"
+SRV_PNPCONDITIONBATCHEVAL = "PNPConditionBatchEval"
 SRV_PNPCONDITIONVALUE = "PNPConditionValue"
 PARAM_PNPACTIONSTATUS = "/PNPActionStatus/"
 PARAM_PNPCONDITIONBUFFER = "PNPconditionsBuffer/"
@@ -11,6 +16,7 @@ ACTION_STARTED = "started"
 ACTION_RUNNING = "running"
 ACTION_INTERRUPT = "interrupt"
 ACTION_SUCCESS = "success"
+ACTION_FAILURE = "failure"
 ACTION_NOT_IMPLEMENTED = "not_implemented"
 
 # PNPPLANFOLDER = "pnp_ros/plan_folder"
@@ -21,3 +27,30 @@ def get_robot_key(name):
     if rospy.has_param('robotname'):
         key = "/"+rospy.get_param('robotname')+"/"+key
     return key
+
+
+_action_status_pub = None
+_action_status_lock = threading.Lock()
+
+def init_action_status_publisher():
+    ''' Create the action status publisher (call it once the node is initialized,
+        so that clients are already connected when the first transition is published) '''
+    global _action_status_pub
+    with _action_status_lock:
+        if _action_status_pub is None:
+            _action_status_pub = rospy.Publisher(get_robot_key(TOPIC_PNPACTIONSTATUS),
+                                                 std_msgs.msg.String, queue_size=100)
+    return _action_status_pub
+
+def publish_action_status(action, status):
+    ''' Store the status of an action and push the transition to the status topic.
+        The parameter is kept for clients that do not subscribe to the topic. '''
+    rospy.set_param(get_robot_key(PARAM_PNPACTIONSTATUS) + action, status)
+    init_action_status_publisher().publish(action + " " + status)
+
+def parse_action_status(data):
+    ''' Inverse of publish_action_status: returns [action, status] '''
+    v = data.rsplit(" ", 1)
+    if len(v) < 2:
+        return [v[0], ""]
+    return v
@@ -0,0 +1,189 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Client of the condition services of PNPActionServer
+
+import threading
+import time
+import rospy
+import pnp_msgs.srv
+
+import pnp_common
+from pnp_common import *
+
+
+class ServiceProxyPool(object):
+    """Pool of persistent connections to a service.
+
+    A persistent proxy cannot be shared by concurrent calls, so each call
+    takes a connection from the pool (opening a new one if all are busy) and
+    puts it back when done. A broken connection is closed and the call is
+    retried once on a new one.
+    """
+
+    def __init__(self, name, service_type):
+        self.name = name
+        self.service_type = service_type
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def _acquire(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        return rospy.ServiceProxy(self.name, self.service_type, persistent=True)
+
+    def _release(self, proxy):
+        with self._lock:
+            self._idle.append(proxy)
+
+    def call(self, *args):
+        proxy = self._acquire()
+        try:
+            r = proxy(*args)
+        except (rospy.ServiceException, rospy.ROSException):
+            # the connection may be closed (e.g. the server restarted): reconnect
+            proxy.close()
+            proxy = rospy.ServiceProxy(self.name, self.service_type, persistent=True)
+            try:
+                r = proxy(*args)
+            except:
+                proxy.close()
+                raise
+        except:
+            proxy.close()
+            raise
+        self._release(proxy)
+        return r
+
+    def close(self):
+        with self._lock:
+            for proxy in self._idle:
+                proxy.close()
+            self._idle = []
+
+
+class ConditionClient(object):
+    """Evaluates conditions through the PNPConditionEval/PNPConditionValue services.
+
+    If cache_ttl > 0 the results are cached for cache_ttl seconds, keyed by
+    the condition literal, so that the same literal asked several times in
+    the same control tick costs a single call.
+
+    If the batch service is missing or fails (e.g. an older PNPActionServer),
+    evaluate_many evaluates the literals one by one with PNPConditionEval and
+    tries the batch service again after batch_retry_period seconds.
+    """
+
+    batch_retry_period = 10.0
+
+    def __init__(self, cache_ttl=0.0):
+        self.cache_ttl = cache_ttl
+        self._eval_pool = ServiceProxyPool(get_robot_key(SRV_PNPCONDITIONEVAL), pnp_msgs.srv.PNPCondition)
+        self._batch_pool = ServiceProxyPool(get_robot_key(SRV_PNPCONDITIONBATCHEVAL), pnp_msgs.srv.PNPConditionBatch)
+        self._value_pool = ServiceProxyPool(get_robot_key(SRV_PNPCONDITIONVALUE), pnp_msgs.srv.PNPConditionValue)
+        self._cache = {}
+        # time after which the batch service is tried again after a failure
+        self._batch_retry_time = 0.0
+
+    def _cached(self, key):
+        if self.cache_ttl > 0:
+            entry = self._cache.get(key)
+            if entry is not None and time.time() - entry[0] < self.cache_ttl:
+                return entry
+        return None
+
+    def _store(self, key, value):
+        if self.cache_ttl > 0:
+            self._cache[key] = (time.time(), value)
+        return value
+
+    def evaluate(self, cond):
+        entry = self._cached(("eval", cond))
+        if entry is not None:
+            return entry[1]
+        r = self._eval_pool.call(cond)
+        return self._store(("eval", cond), r.truth_value != 0)
+
+    def evaluate_many(self, conds):
+        # a single call for all the literals that are not cached
+        values = [self._cached(("eval", cond)) for cond in conds]
+        missing = [cond for cond, entry in zip(conds, values) if entry is None]
+        if missing:
+            evaluated = self._evaluate_batch(missing)
+            for cond, value in evaluated.items():
+                self._store(("eval", cond), value)
+        return [entry[1] if entry is not None else evaluated[cond]
+                for cond, entry in zip(conds, values)]
+
+    def _evaluate_batch(self, conds):
+        if time.time() >= self._batch_retry_time:
+            try:
+                r = self._batch_pool.call(conds)
+                return dict(zip(conds, [v != 0 for v in r.truth_values]))
+            except (rospy.ServiceException, rospy.ROSException) as e:
+                rospy.logwarn("Batch condition service failed, evaluating the conditions one by one: %s" % e)
+                self._batch_retry_time = time.time() + self.batch_retry_period
+        return dict((cond, self._eval_pool.call(cond).truth_value != 0) for cond in conds)
+
+    def get_value(self, cond):
+        entry = self._cached(("value", cond))
+        if entry is not None:
+            return entry[1]
+        r = self._value_pool.call(cond)
+        return self._store(("value", cond), r.value)
+
+    def invalidate(self):
+        self._cache = {}
+
+    def close(self):
+        self._eval_pool.close()
+        self._batch_pool.close()
+        self._value_pool.close()
+
+
+class LocalConditionClient(object):
+    """Same interface of ConditionClient, reading the ConditionManager of this process.
+
+    Installed by PNPActionServer, so that the actions and conditions it hosts
+    do not call the condition services of their own process.
+    """
+
+    def __init__(self, condition_manager):
+        self._condition_manager = condition_manager
+
+    def evaluate(self, cond):
+        return bool(self._condition_manager.evaluate_condition(cond))
+
+    def evaluate_many(self, conds):
+        return [bool(v) for v in self._condition_manager.evaluate_batch(conds)]
+
+    def get_value(self, cond):
+        # same string of the PNPConditionValue service
+        value = str(self._condition_manager.get_value(cond))
+        return value if value else "None"
+
+    def invalidate(self):
+        pass
+
+    def close(self):
+        pass
+
+
+_condition_client = None
+_condition_client_lock = threading.Lock()
+
+def set_condition_client(client):
+    ''' Install the client returned by get_condition_client (e.g. a LocalConditionClient) '''
+    global _condition_client
+    with _condition_client_lock:
+        _condition_client = client
+
+def get_condition_client():
+    ''' Client used by actions and conditions: the installed one, or a
+        ConditionClient of the services when running out of PNPActionServer '''
+    global _condition_client
+    with _condition_client_lock:
+        if _condition_client is None:
+            _condition_client = ConditionClient()
+        return _condition_client
@@ -0,0 +1,186 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Discovery of the action and condition plugins.
+#
+# The python files of the plugin folders are scanned statically (ast) for a
+# class with the same name of the module deriving from the plugin base
+# class (AbstractAction, AbstractCondition). The result of the scan is
+# stored in a manifest keyed by the mtime of the files, so only new or
+# modified files are parsed again. Modules are imported only the first
+# time the plugin is used.
+
+import os
+import ast
+import json
+import time
+import fnmatch
+import threading
+import rospy
+
+
+def get_manifest_path(kind):
+    ros_home = os.environ.get("ROS_HOME", os.path.join(os.path.expanduser("~"), ".ros"))
+    return os.path.join(ros_home, "pnp_plugins_%s.json" % kind)
+
+
+def _base_name(node):
+    if isinstance(node, ast.Name):
+        return node.id
+    if isinstance(node, ast.Attribute):
+        return node.attr
+    return None
+
+
+def _is_abstract_decorator(node):
+    if isinstance(node, ast.Call):
+        node = node.func
+    return _base_name(node) in ("abstractmethod", "abstractproperty")
+
+
+def scan_file(path):
+    ''' Classes defined in the file: {name: {"bases": [...], "abstract": bool}} '''
+    with open(path) as f:
+        tree = ast.parse(f.read(), path)
+    classes = {}
+    for node in tree.body:
+        if not isinstance(node, ast.ClassDef):
+            continue
+        abstract = any(_is_abstract_decorator(d)
+                       for item in node.body
+                       if isinstance(item, (ast.FunctionDef, ast.AsyncFunctionDef))
+                       for d in item.decorator_list)
+        classes[node.name] = {
+            "bases": [b for b in (_base_name(base) for base in node.bases) if b is not None],
+            "abstract": abstract,
+        }
+    return classes
+
+
+def _python_files(folders):
+    files = []
+    visited = set()
+    for folder in folders:
+        if folder is None or os.path.realpath(folder) in visited:
+            continue
+        visited.add(os.path.realpath(folder))
+        files += [os.path.join(dirpath, f)
+                  for dirpath, _, fs in os.walk(folder, followlinks=True)
+                  for f in fnmatch.filter(fs, '*.py')]
+    return files
+
+
+def discover_plugins(folders, base_class_name, manifest_path=None):
+    ''' Returns {plugin name: file} of the non abstract classes deriving from base_class_name '''
+    manifest = {}
+    if manifest_path is not None and os.path.exists(manifest_path):
+        try:
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+        except (IOError, ValueError) as e:
+            rospy.logwarn("Cannot read plugin manifest %s: %s" % (manifest_path, e))
+
+    new_manifest = {}
+    classes = {}  # class name -> (file, info)
+    for path in _python_files(folders):
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            continue
+        entry = manifest.get(path)
+        if entry is None or entry["mtime"] != mtime:
+            try:
+                entry = {"mtime": mtime, "classes": scan_file(path)}
+            except (SyntaxError, ValueError, IOError) as e:
+                rospy.logwarn("Cannot scan %s: %s" % (path, e))
+                continue
+        new_manifest[path] = entry
+        for class_name, info in entry["classes"].items():
+            classes.setdefault(class_name, (path, info))
+
+    if manifest_path is not None and new_manifest != manifest:
+        try:
+            if not os.path.isdir(os.path.dirname(manifest_path)):
+                os.makedirs(os.path.dirname(manifest_path))
+            with open(manifest_path, "w") as f:
+                json.dump(new_manifest, f)
+        except (IOError, OSError) as e:
+            rospy.logwarn("Cannot write plugin manifest %s: %s" % (manifest_path, e))
+
+    derived = {}
+
+    def derives_from_base(class_name, visiting=()):
+        if class_name == base_class_name:
+            return True
+        if class_name in derived:
+            return derived[class_name]
+        if class_name not in classes or class_name in visiting:
+            return False
+        result = any(derives_from_base(b, visiting + (class_name,))
+                     for b in classes[class_name][1]["bases"])
+        derived[class_name] = result
+        return result
+
+    plugins = {}
+    for class_name, (path, info) in classes.items():
+        module_name = os.path.splitext(os.path.basename(path))[0]
+        if class_name != module_name or class_name == base_class_name or info["abstract"]:
+            continue
+        if derives_from_base(class_name):
+            plugins[class_name] = path
+    return plugins
+
+
+class LazyPlugin(object):
+    ''' Plugin class imported at the first get() through loader(file, module_name) '''
+
+    def __init__(self, name, path, loader):
+        self.name = name
+        self.path = path
+        self._loader = loader
+        self._class = None
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def get(self):
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    self._class = self._loader(self.path, self.name)
+                    self._loaded = True
+        return self._class
+
+
+class PluginReloader(threading.Thread):
+    ''' Watches the plugin folders and calls on_change(changed_files) when
+        python files are added, modified or removed (mtime polling) '''
+
+    def __init__(self, folders, on_change, period=2.0):
+        threading.Thread.__init__(self, name="pnp_plugin_reloader")
+        self.daemon = True
+        self.folders = folders
+        self.on_change = on_change
+        self.period = period
+
+    def _snapshot(self):
+        mtimes = {}
+        for path in _python_files(self.folders):
+            try:
+                mtimes[path] = os.stat(path).st_mtime
+            except OSError:
+                pass
+        return mtimes
+
+    def run(self):
+        last = self._snapshot()
+        while not rospy.is_shutdown():
+            time.sleep(self.period)
+            current = self._snapshot()
+            changed = set(path for path in current if last.get(path) != current[path])
+            changed |= set(path for path in last if path not in current)
+            if changed:
+                try:
+                    self.on_change(changed)
+                except Exception as e:
+                    rospy.logerr("Error reloading plugins: %s" % e)
+            last = current
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+# DemonstrationRecorder compared with the list-based recording it replaced,
+# on random traces of condition updates
+
+import os
+import sys
+import random
+import unittest
+
+PKG_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+os.environ.setdefault("PNP_HOME", PKG_DIR)
+sys.path.insert(0, os.path.join(PKG_DIR, "scripts"))
+sys.path.insert(0, os.path.join(PKG_DIR, "conditions"))
+
+from StateActionPairGenerator import DemonstrationRecorder
+
+CONDITIONS = ["A", "B", "C", "D", "Act", "Go"]
+
+
+class ListRecorder(object):
+    ''' Timesteps stored as lists of entries, as StateActionPairGenerator did before the columns '''
+
+    def __init__(self, state_conditions, action_conditions):
+        self.state_conditions = list(state_conditions)
+        self.action_conditions = list(action_conditions)
+        self.states = []
+        self.actions = []
+
+    def is_state_condition(self, condition_name):
+        return condition_name in self.state_conditions or len(self.state_conditions) == 0
+
+    def add_state(self, condition_name, entry):
+        if len(self.states) == 0 or condition_name in [cond.split("_")[0] for cond in self.states[-1]]:
+            self.states.append([entry])
+            self.actions.append([])
+        else:
+            self.states[-1].append(entry)
+            for timestep in range(len(self.states) - 2, -1, -1):
+                if not condition_name in [cond.split("_")[0] for cond in self.states[timestep]]:
+                    self.states[timestep].append(entry)
+                else:
+                    break
+
+    def add_actions(self, executed_actions):
+        if len(self.actions) > 1 and len(self.actions[-2]) == 0:
+            self.actions[-2] = executed_actions
+            for timestep in range(len(self.actions) - 3, -1, -1):
+                if len(self.actions[timestep]) == 0:
+                    del self.actions[timestep]
+                    del self.states[timestep]
+                else:
+                    break
+
+    def lines(self):
+        lines = []
+        for (states, actions) in zip(self.states, self.actions):
+            if len(states) < len(self.state_conditions) or len(actions) < len(self.action_conditions):
+                continue
+            lines.append("  ".join(states) + "\t" + "  ".join(actions) + "\n")
+        return lines
+
+
+class Lines(object):
+    ''' File collecting the written lines '''
+
+    def __init__(self):
+        self.text = ""
+
+    def write(self, text):
+        self.text += text
+
+
+def random_trace(rng, length):
+    return [(rng.choice(CONDITIONS), "v%d" % rng.randint(0, 3)) for _ in range(length)]
+
+
+def random_request(rng):
+    state_conditions = rng.sample(CONDITIONS[:4], rng.randint(0, 3))
+    action_conditions = rng.sample(CONDITIONS[4:], rng.randint(0, 1))
+    return state_conditions, action_conditions
+
+
+def record(recorder, trace, streaming=None):
+    ''' Same steps of StateActionPairGenerator.receive_update; when the action
+        conditions are not given, an action is inferred from the values v0.
+        With streaming, the final lines are written after each update. '''
+    for (condition_name, condition_value) in trace:
+        entry = condition_name + "_" + condition_value
+        action_candidates = []
+        if recorder.is_state_condition(condition_name):
+            recorder.add_state(condition_name, entry)
+            if len(recorder.action_conditions) == 0 and condition_value == "v0":
+                action_candidates.append("goto_" + condition_value)
+        if condition_name in recorder.action_conditions:
+            action_candidates.append(entry)
+        recorder.add_actions(action_candidates[:])
+        if streaming is not None:
+            streaming.write("".join(recorder.pop_final_lines()))
+
+
+class TestDemonstrationRecorder(unittest.TestCase):
+
+    def test_same_lines_as_list_recording(self):
+        rng = random.Random(1)
+        for _ in range(2000):
+            (state_conditions, action_conditions) = random_request(rng)
+            trace = random_trace(rng, rng.randint(0, 60))
+
+            expected = ListRecorder(state_conditions, action_conditions)
+            record(expected, trace)
+            recorder = DemonstrationRecorder(state_conditions, action_conditions)
+            record(recorder, trace)
+            output = Lines()
+            recorder.write(output)
+
+            self.assertEqual(output.text, "".join(expected.lines()),
+                             "trace %s, state conditions %s, action conditions %s"
+                             % (trace, state_conditions, action_conditions))
+
+    def test_streaming_same_lines(self):
+        # with explicit state conditions the streamed file is the same
+        rng = random.Random(2)
+        for _ in range(2000):
+            (state_conditions, action_conditions) = random_request(rng)
+            if len(state_conditions) == 0:
+                continue
+            trace = random_trace(rng, rng.randint(0, 60))
+
+            recorder = DemonstrationRecorder(state_conditions, action_conditions)
+            record(recorder, trace)
+            expected = Lines()
+            recorder.write(expected)
+            recorder = DemonstrationRecorder(state_conditions, action_conditions)
+            streamed = Lines()
+            record(recorder, trace, streamed)
+            recorder.write(streamed)
+
+            self.assertEqual(streamed.text, expected.text,
+                             "trace %s, state conditions %s, action conditions %s"
+                             % (trace, state_conditions, action_conditions))
+
+    def test_streaming_pops_lines(self):
+        # the lines are written during the recording, not only at the stop
+        recorder = DemonstrationRecorder(["A", "B"], ["Act"])
+        streamed = Lines()
+        record(recorder, [("A", "v1"), ("B", "v1"), ("Act", "v1"), ("A", "v2"), ("Act", "v2"), ("B", "v2")], streamed)
+        self.assertEqual(streamed.text, "A_v1  B_v1\tAct_v2\n")
+
+
+if __name__ == "__main__":
+    unittest.main()
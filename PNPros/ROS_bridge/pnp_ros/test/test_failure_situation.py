@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+# FailureSituation evaluated on the condition snapshot (as the eval services do)
+
+import os
+import sys
+import time
+import unittest
+
+PKG_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+os.environ.setdefault("PNP_HOME", PKG_DIR)
+sys.path.insert(0, os.path.join(PKG_DIR, "scripts"))
+sys.path.insert(0, os.path.join(PKG_DIR, "conditions"))
+
+import rospy
+from pnp_msgs.msg import ActionFailure
+from ConditionManager import ConditionManager
+
+
+class TestFailureSituation(unittest.TestCase):
+
+    def setUp(self):
+        # rospy.Time.now() without a node
+        rospy.rostime.set_rostime_initialized(True)
+        self.condition_manager = ConditionManager()
+        self.condition = self.condition_manager.get_condition_instance("FailureSituation")
+
+    def signal(self, cause):
+        self.condition._callback(ActionFailure(cause=cause, stamp=rospy.Time.now()))
+
+    def test_same_cause_twice(self):
+        self.signal("obstacle")
+        self.assertTrue(self.condition_manager.evaluate_condition("FailureSituation_obstacle"))
+        time.sleep(0.6)
+        self.assertFalse(self.condition_manager.evaluate_condition("FailureSituation_obstacle"))
+        # same cause, same value: the new stamp must reach the snapshot
+        self.signal("obstacle")
+        self.assertTrue(self.condition_manager.evaluate_condition("FailureSituation_obstacle"))
+        self.assertTrue(self.condition_manager.evaluate_condition("FailureSituation"))
+        self.assertFalse(self.condition_manager.evaluate_condition("FailureSituation_other"))
+
+
+if __name__ == "__main__":
+    unittest.main()